@@ -48,6 +48,48 @@ void main (void)
 }
 """
 
+# The seed positions computed from the vertex index, the angle steps are
+# given in turns, split in two (the index low and high bytes) to keep the
+# float precision of the large angles.
+procedural_vertex = """
+#version 130
+
+uniform mat4 model;
+uniform mat4 view;
+uniform mat4 projection;
+uniform float radius;
+uniform float turns;
+uniform float turns_256;
+uniform float theta_step;
+uniform float distance_step;
+uniform float cutoff;
+uniform float count;
+
+varying float v_radius;
+varying float v_distance;
+varying float v_cutoff;
+
+const float TAU = 6.283185307179586;
+
+void main (void)
+{
+    v_radius = radius;
+    v_distance = float(gl_VertexID) / (count - 1.0);
+    v_cutoff = cutoff;
+
+    float high = float(gl_VertexID / 256);
+    float low = float(gl_VertexID % 256);
+    float angle = TAU * fract(fract(high * turns_256) + low * turns);
+    float thet = float(gl_VertexID) * theta_step;
+    float dist = float(gl_VertexID) * distance_step;
+    vec3 position = dist * vec3(
+        sin(angle) * cos(thet), sin(angle) * sin(thet), cos(angle));
+
+    gl_Position = projection * view * model * vec4(position,1.0);
+    gl_PointSize = 2 * v_radius;
+}
+"""
+
 fragment = """
 #version 120
 
@@ -95,16 +137,23 @@ params = {
 }
 
 n = 100000
+# Compute the seed positions in the vertex shader instead of uploading them
+PROCEDURAL = True
 
 
 class FlowerSeedsGL(gamegl.Window):
     def init_program(self):
-        self.program = gloo.Program(vertex, fragment, count=n)
-        self.program['position'] = np.zeros((n, 3), dtype=np.float32)
+        if PROCEDURAL:
+            # Only uniforms, the vertices are numbered by the draw call
+            self.program = gloo.Program(procedural_vertex, fragment)
+            self.program['count'] = n
+        else:
+            self.program = gloo.Program(vertex, fragment, count=n)
+            self.program['position'] = np.zeros((n, 3), dtype=np.float32)
+            self.program["distance"] = np.linspace(0, 1, n)
         self.program['radius'] = 1
         self.program['projection'] = glm.perspective(
             45.0, self.winsize[0] / float(self.winsize[1]), 1.0, 1000.0)
-        self.program["distance"] = np.linspace(0, 1, n)
 
         gl.glEnable(gl.GL_DEPTH_TEST)
 
@@ -156,6 +205,33 @@ class FlowerSeedsGL(gamegl.Window):
         self.program['radius'] = self.params["size"]
         self.program['cutoff'] = self.params['cutoff']
 
+        if PROCEDURAL:
+            self.update_steps()
+        else:
+            self.update_positions()
+
+        # Drawing
+        self.window.clear()
+        if PROCEDURAL:
+            # program.draw needs an attribute to count the vertices
+            self.program.activate()
+            gl.glDrawArrays(gl.GL_POINTS, 0, n)
+            self.program.deactivate()
+        else:
+            self.program.draw(gl.GL_POINTS)
+        self.draw = False
+        return True
+
+    def update_steps(self):
+        # The linspace steps of update_positions
+        angle_turns = self.params["ratio"] * n / (n - 1) / 2
+        self.program['turns'] = angle_turns % 1
+        self.program['turns_256'] = angle_turns * 256 % 1
+        self.program['theta_step'] = np.pi * self.params["ratio"] * 2 / (n - 1)
+        self.program['distance_step'] = (
+            0.00005 + self.params["distance"]) * n / (n - 1)
+
+    def update_positions(self):
         position = self.program['position']
         angles = np.linspace(0, np.pi * self.params["ratio"] * n, n)
         thet = np.linspace(0, np.pi * self.params["ratio"] * 2, n)
@@ -166,12 +242,6 @@ class FlowerSeedsGL(gamegl.Window):
         position[:, 1] = distances * np.sin(angles) * np.sin(thet)
         position[:, 2] = distances * np.cos(angles)
 
-        # Drawing
-        self.window.clear()
-        self.program.draw(gl.GL_POINTS)
-        self.draw = False
-        return True
-
 
 class Demo(animation.Animation):
     def __init__(self):
@@ -100,7 +100,6 @@ def jiggle(args, audio_mod=None):
             },
             "c_space_image": "log",
             "audio_mod": {
-                "color": 2,
                 "c_real": 0.000002,
             },
             "max_iter": 2048,
@@ -253,10 +252,6 @@ def jiggle(args, audio_mod=None):
                 seed_imag += amod * mod["audio_mod"]["c_imag"] * p
             if mod["audio_mod"].get("c_real"):
                 seed_real += amod * mod["audio_mod"]["c_real"] * p
-            if mod["audio_mod"].get("color"):
-                cmod = mod["audio_mod"]["color"] * amod
-                scene.color_vector = np.vectorize(args.color(args.max_iter,
-                                                             cmod))
 
         scene.c = complex(seed_real, seed_imag)
     return update_view
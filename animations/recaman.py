@@ -17,10 +17,12 @@ https://www.youtube.com/watch?v=FGC5TdIiT9U
 """
 
 import collections
-import colorsys
 import math
 
+import numpy as np
+
 from utils import animation
+from utils import hsv_array
 from utils import game
 from utils import audio
 
@@ -48,30 +50,27 @@ class RecamanCircle(game.Window):
         self.series = collections.deque(maxlen=512)
         self.mod = 84
 
-    def circle_point(self, mod, point):
-        # Return coordinate of a point on a mod circle
-        angle = ((point % mod) * 360 / float(mod)) * math.pi / 180.0
-        return (int(self.window_size[0] / 2 + self.radius * math.sin(angle)),
-                int(self.window_size[1] / 2 + self.radius * math.cos(angle)))
+    def circle_points(self, mod, points):
+        # Return coordinates of points on a mod circle
+        angle = np.asarray(points) % mod * 360 / float(mod) * math.pi / 180.0
+        return np.stack((
+            self.window_size[0] / 2 + self.radius * np.sin(angle),
+            self.window_size[1] / 2 + self.radius * np.cos(angle)), axis=-1
+        ).astype(int)
 
     def render(self, frame):
         self.fill()
-        v = 1
         deltav = 0.8 / (len(self.series) + 1)
         deltau = 0.4 / (len(self.series) + 1)
-        draw_call = []
-        width = 4
-        for j in range(len(self.series) - 1, 0, -1):
-            s = self.circle_point(self.mod, self.series[j])
-            e = self.circle_point(self.mod, self.series[j - 1])
-            color = list(map(lambda x: x * 255, colorsys.hsv_to_rgb(
-                self.hue, v, v)))
-            self.hue += deltau
-            v -= deltav
-            draw_call.append((s, e, color, width))
-            width = 1
-        for s, e, color, width in reversed(draw_call):
-            self.draw_line(s, e, color, width)
+        if len(self.series) > 1:
+            # Segments from the most recent point, drawn oldest first
+            coords = self.circle_points(self.mod, self.series)
+            step = np.arange(len(self.series) - 2, -1, -1)
+            v = 1 - deltav * step
+            colors = hsv_array(self.hue + deltau * step, v, v) * 255
+            widths = np.where(step == 0, 4, 1)
+            self.draw_lines(coords[1:], coords[:-1], colors, widths)
+            self.hue += deltau * (len(self.series) - 1)
         if self.series:
             print(self.series[-1])
         return True
@@ -13,6 +13,8 @@
 import colorsys
 import math
 
+import numpy as np
+
 
 MAX_SHORT = float((2 ** (2 * 8)) // 2)
 PHI = (1+math.sqrt(5))/2.0
@@ -31,6 +33,29 @@ def hsv(h, s, v):
     return int(b * 0xff) | int((g * 0xff)) << 8 | int(r * 0xff) << 16
 
 
+def hsv_array(h, s, v):
+    """colorsys.hsv_to_rgb for arrays, return a (n, 3) array of rgb"""
+    h, s, v = np.broadcast_arrays(*map(np.asarray, (h, s, v)))
+    i = np.trunc(h * 6.0)
+    f = (h * 6.0) - i
+    p = v * (1.0 - s)
+    q = v * (1.0 - s * f)
+    t = v * (1.0 - s * (1.0 - f))
+    i = i.astype(int) % 6
+    channels = np.stack([
+        (v, t, p), (q, v, p), (p, v, t), (p, q, v), (t, p, v), (v, p, q)])
+    rgb = np.moveaxis(np.take_along_axis(channels, i[np.newaxis, np.newaxis],
+                                         axis=0)[0], 0, -1)
+    rgb[s == 0] = v[s == 0][..., np.newaxis]
+    return rgb
+
+
+def pack_rgb(rgb, scale=0xff):
+    """rgb for a (..., 3) array of channels, use scale=1 for rgb250"""
+    rgb = (np.asarray(rgb) * scale).astype(np.int64)
+    return rgb[..., 2] | rgb[..., 1] << 8 | rgb[..., 0] << 16
+
+
 def rotate_point(point, angle):
     return complex(point[0] * math.cos(angle) - point[1] * math.sin(angle),
                    point[0] * math.sin(angle) + point[1] * math.cos(angle))
@@ -19,7 +19,7 @@ import time
 import numpy as np
 
 from . import game
-from . audio import Audio, NoAudio
+from . audio import AUDIO_SYNC, Audio, AudioAnalyzer, NoAudio
 from . controller import Controller
 from . fractal import Fractal
 from . midi import Midi, NoMidi
@@ -30,6 +30,8 @@ def usage():
     parser.add_argument("--paused", action='store_true')
     parser.add_argument("--record", metavar="DIR", help="record frame in png")
     parser.add_argument("--wav", metavar="FILE")
+    parser.add_argument("--live", action="store_true",
+                        help="analyze the default audio input")
     parser.add_argument("--midi", metavar="FILE")
     parser.add_argument("--midi_skip", type=int, default=0)
     parser.add_argument("--fps", type=int, default=25)
@@ -41,6 +43,8 @@ def usage():
     parser.add_argument("--debug", action="store_true",
                         help="show debug information")
     args = parser.parse_args()
+    if args.wav and args.live:
+        parser.error("--live can't be used with --wav")
     args.winsize = list(map(lambda x: int(x * args.size), [160,  90]))
     args.map_size = list(map(lambda x: x//5, args.winsize))
     args.length = args.winsize[0] * args.winsize[1]
@@ -60,6 +64,7 @@ class Animation(Controller):
         self.midi_events = {}
         self.audio_events = {}
         self.spectre = None
+        self.analyzer = None
         self.silent = False
         super().__init__(params)
 
@@ -69,6 +74,19 @@ class Animation(Controller):
     def setAudio(self, audio):
         self.audio = audio
 
+    def setAnalyzer(self, analyzer):
+        self.analyzer = analyzer
+        self.analyzer.start()
+
+    def updateAnalyzer(self, frame=None):
+        values, freq, band = self.analyzer.read()
+        for k, v in values.items():
+            setattr(self, k, v)
+        if self.spectre is not None:
+            # Feed the spectrogram widgets
+            self.spectre.freq = freq
+            self.spectre.band = band
+
     def updateAudio(self, audio_buf, frame=None):
         if self.spectre is not None:
             self.spectre.transform(audio_buf)
@@ -81,7 +99,10 @@ class Animation(Controller):
 
     def updateMidi(self, midi_events, frame=None):
         for k, v in self.midi_events.items():
-            setattr(self, k, v.update(midi_events))
+            if frame is None:
+                setattr(self, k, v.update(midi_events))
+            else:
+                setattr(self, k, v.lookup(self.midi, frame + self.midi_skip))
         if not self.silent and midi_events:
             print(midi_events)
 
@@ -100,11 +121,14 @@ class Animation(Controller):
 
     def update(self, frame):
         if not self.paused:
-            try:
-                audio_buf = self.audio.get(frame)
-                self.updateAudio(audio_buf, frame)
-            except IndexError:
-                pass
+            if self.analyzer:
+                self.updateAnalyzer(frame)
+            else:
+                try:
+                    audio_buf = self.audio.get(frame)
+                    self.updateAudio(audio_buf, frame)
+                except IndexError:
+                    pass
             try:
                 midi_events = self.midi.get(frame + self.midi_skip)
                 self.updateMidi(midi_events, frame)
@@ -135,9 +159,19 @@ def run_main(demo, Scene=Fractal):
 
     if args.wav:
         audio = Audio(args.wav, args.fps, play=not args.record)
+    elif args.live:
+        audio = Audio(None, args.fps)
     else:
         audio = NoAudio()
     demo.setAudio(audio)
+    if args.live:
+        if type(demo).updateAudio is not Animation.updateAudio:
+            # The custom audio update needs the blocks in the render loop
+            print("%s.updateAudio: analyzing live input in the render loop" %
+                  type(demo).__name__)
+        else:
+            demo.setAnalyzer(AudioAnalyzer(
+                audio.input, audio.blocksize, demo.audio_events))
 
     if args.midi:
         midi = Midi(args.midi)
@@ -189,9 +223,21 @@ def run_main(demo, Scene=Fractal):
             print("%04d: %.2f sec '%s'" % (
                 frame, time.monotonic() - start_time,
                 json.dumps(demo.get(), sort_keys=True)))
+            if demo.analyzer:
+                print("      audio latency: %.1f ms" % (
+                    demo.analyzer.latency * 1000))
 
         if not args.record:
-            clock.tick(args.fps)
+            if audio.player and audio.play and not demo.paused:
+                # Follow the audio clock, keeping a few blocks queued
+                audio.player.sync(AUDIO_SYNC / args.fps)
+            else:
+                if audio.player:
+                    audio.player.pause()
+                clock.tick(args.fps)
+
+    if demo.analyzer:
+        demo.analyzer.stop()
 
     if args.record:
         import subprocess
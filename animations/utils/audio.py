@@ -11,6 +11,8 @@
 # under the License.
 
 import queue
+import threading
+import time
 
 import sounddevice as sd
 import soundfile as sf
@@ -19,9 +21,33 @@ import scipy.signal.filter_design as fd
 import scipy.signal.signaltools as st
 
 
+# Number of audio blocks to keep queued when syncing to the audio clock
+AUDIO_SYNC = 4
+
+# Seconds the analyzer waits for an input block before checking for stop()
+ANALYZER_TIMEOUT = 0.1
+
+
 class AudioPlayer:
-    def __init__(self, samplerate, blocksize, channels):
-        self.queue = queue.Queue(maxsize=25)
+    """Play int16 blocks through a preallocated ring buffer.
+
+    The render side writes with play() and the PortAudio callback only
+    copies slices out of the ring. The written/played counters are only
+    ever increased by their own side.
+    """
+    def __init__(self, samplerate, blocksize, channels, buffer_blocks=25):
+        self.samplerate = samplerate
+        self.blocksize = blocksize
+        self.frame_bytes = 2 * channels
+        self.size = buffer_blocks * blocksize * self.frame_bytes
+        self.ring = np.zeros(self.size, dtype=np.uint8)
+        self.silence = bytes(self.size)
+        self.written = 0
+        self.played = 0
+        self.underflows = 0
+        self.overflows = 0
+        # Set while the render side doesn't write, e.g. when paused
+        self.idle = False
         self.stream = sd.RawOutputStream(
             samplerate=samplerate, blocksize=blocksize,
             device="default", channels=channels, dtype='int16',
@@ -29,23 +55,58 @@ class AudioPlayer:
             callback=self.callback, finished_callback=self.finished)
 
     def play(self, buf):
-        self.queue.put(buf)
+        data = np.frombuffer(np.ascontiguousarray(buf), dtype=np.uint8)
+        if self.written - self.played + len(data) > self.size:
+            self.overflows += 1
+            return
+        pos = self.written % self.size
+        head = min(len(data), self.size - pos)
+        self.ring[pos:pos + head] = data[:head]
+        self.ring[:len(data) - head] = data[head:]
+        self.written += len(data)
+        self.idle = False
         if not self.stream.active:
             self.stream.start()
 
-    def callback(self, outdata, frames, time, status):
+    def callback(self, outdata, frames, time_info, status):
         if status.output_underflow:
-            print("Underflow...")
-        try:
-            data = self.queue.get_nowait().tobytes()
-        except queue.Empty:
-            # TODO: display this message when scene is not paused
-            #       or stop the stream when scene is paused
-            #print('Buffer is empty: increase buffersize?')
-            data = b''
-        if len(data) < len(outdata):
-            data += b'\x00' * (len(outdata) - len(data))
-        outdata[:] = data
+            self.underflows += 1
+        size = min(len(outdata), self.written - self.played)
+        pos = self.played % self.size
+        head = min(size, self.size - pos)
+        outdata[:head] = self.ring[pos:pos + head]
+        outdata[head:size] = self.ring[:size - head]
+        if size < len(outdata):
+            if self.written and not self.idle:
+                # The render side didn't keep up
+                self.underflows += 1
+            outdata[size:] = self.silence[:len(outdata) - size]
+        self.played += size
+
+    @property
+    def position(self):
+        """The playback position in seconds"""
+        return self.played / self.frame_bytes / self.samplerate
+
+    @property
+    def buffered(self):
+        """The amount of queued audio in seconds"""
+        return (self.written - self.played) / self.frame_bytes / \
+            self.samplerate
+
+    @property
+    def latency(self):
+        return self.buffered + self.stream.latency
+
+    def pause(self):
+        """Play silence without counting underflows until the next play()"""
+        self.idle = True
+
+    def sync(self, max_buffered):
+        """Wait for the audio clock to drain the buffer below max_buffered"""
+        period = self.blocksize / self.samplerate / 4
+        while self.stream.active and self.buffered > max_buffered:
+            time.sleep(period)
 
     def finished(self):
         print("Over...")
@@ -59,10 +120,24 @@ class AudioInput:
             samplerate=freq, blocksize=freq // fps,
             callback=self.callback)
 
-    def callback(self, indata, frames, time, status):
+    def callback(self, indata, frames, time_info, status):
         if status:
             print("Input status:", status)
-        self.queue.put(indata)
+        # Stamp the block with the monotonic time of its first sample
+        adc_delay = time_info.currentTime - time_info.inputBufferAdcTime
+        try:
+            self.queue.put_nowait((indata.copy(), time.monotonic() - adc_delay))
+        except queue.Full:
+            pass
+
+    def get(self, timeout=None):
+        """Return the next (block, capture time) tuple, waiting if needed.
+
+        Raises queue.Empty when no block arrived within timeout seconds.
+        """
+        if not self.stream.active:
+            self.stream.start()
+        return self.queue.get(timeout=timeout)
 
     def read(self):
         if not self.stream.active:
@@ -70,7 +145,103 @@ class AudioInput:
         while self.queue.qsize() > 1:
             print("Audio input dropping...")
             self.queue.get()
-        return self.queue.get()
+        return self.queue.get()[0]
+
+
+class AudioAnalyzer(threading.Thread):
+    """Capture and analyze live input in a dedicated worker thread.
+
+    The worker runs the spectrogram and the audio mods for every input block
+    and publishes the results in a double buffer guarded by a sequence
+    counter, so that the render loop can read the latest values without
+    waiting on the audio device.
+    """
+    def __init__(self, audio_input, frame_size, mods):
+        super().__init__(daemon=True)
+        if audio_input is None:
+            raise RuntimeError("AudioAnalyzer needs a live audio input")
+        self.input = audio_input
+        self.spectre = SpectroGram(frame_size)
+        self.mods = mods
+        self.names = list(mods.keys())
+        self.values = np.zeros((2, len(self.names)))
+        self.freq = np.zeros((2, frame_size // 2))
+        self.band = np.zeros((2, frame_size // 2))
+        self.stamps = [0.0, 0.0]
+        # Odd while a slot is being written
+        self.seq = 0
+        self.front = 0
+        self.latency = 0.0
+        self.alive = True
+
+    def run(self):
+        while self.alive:
+            try:
+                # Wake up regularly to notice stop()
+                buf, stamp = self.input.get(timeout=ANALYZER_TIMEOUT)
+            except queue.Empty:
+                continue
+            self.spectre.transform(buf)
+            back = 1 - self.front
+            for idx, name in enumerate(self.names):
+                self.values[back, idx] = self.mods[name].update(self.spectre)
+            self.freq[back] = self.spectre.freq
+            self.band[back] = self.spectre.band
+            self.stamps[back] = stamp
+            self.seq += 1
+            self.front = back
+            self.seq += 1
+
+    def read(self):
+        """Return the latest (mods values, freq, band), never blocking on the
+        worker"""
+        while True:
+            seq = self.seq
+            front = self.front
+            values = dict(zip(self.names, self.values[front]))
+            freq = self.freq[front].copy()
+            band = self.band[front].copy()
+            stamp = self.stamps[front]
+            if seq == self.seq and not seq & 1:
+                break
+        if stamp:
+            self.latency = time.monotonic() - stamp
+        return values, freq, band
+
+    def stop(self):
+        self.alive = False
+        if self.is_alive():
+            self.join()
+
+
+class AudioReader:
+    """Decode an audio file on demand, keeping a small read-ahead cache.
+
+    Slicing returns int16 frames like the fully decoded array would, so that
+    memory usage doesn't depend on the track length.
+    """
+    def __init__(self, audio_file, cache_size):
+        self.file = sf.SoundFile(audio_file)
+        self.cache = np.zeros((cache_size, self.file.channels), dtype='int16')
+        self.cache_start = 0
+        self.cache_end = 0
+
+    def __len__(self):
+        return self.file.frames
+
+    def __getitem__(self, key):
+        start, stop, _ = key.indices(len(self))
+        if stop - start > len(self.cache):
+            self.file.seek(start)
+            return self.file.read(stop - start, dtype='int16', always_2d=True)
+        if start < self.cache_start or stop > self.cache_end:
+            self.file.seek(start)
+            read = self.file.read(len(self.cache), dtype='int16',
+                                  always_2d=True, out=self.cache)
+            self.cache_start = start
+            self.cache_end = start + len(read)
+        return self.cache[start - self.cache_start:
+                          stop - self.cache_start].copy()
 
 
 class Audio:
@@ -82,11 +253,12 @@ class Audio:
             self.input = AudioInput(fps, freq)
             self.wav = []
         else:
-            ifile = sf.SoundFile(audio_file)
+            ifile = sf.info(audio_file)
             freq = ifile.samplerate
             channels = ifile.channels
             self.input = None
-            self.wav = ifile.read(-1, dtype='int16')
+            # Read ahead a couple of seconds
+            self.wav = AudioReader(audio_file, 2 * freq)
         self.play = play
         if freq % fps != 0:
             raise RuntimeError("Can't load %d Hz at %d fps" % (freq, fps))
@@ -117,6 +289,7 @@ class Audio:
 
 class NoAudio:
     blocksize = 1
+    player = None
 
     def get(self, _):
         return [(0, 0)]
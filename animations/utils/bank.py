@@ -0,0 +1,147 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Evaluate AudioMod and MidiMod over a whole timeline at once"""
+
+import numpy as np
+
+from . audio import SpectroGram
+
+try:
+    from numba import njit
+except ImportError:
+    print("Install numba for faster modulation scan")
+
+    def njit(**kwargs):
+        return lambda func: func
+
+
+@njit(cache=True, error_model='numpy')
+def decay_scan(values, decays, prev):
+    """The per frame 'prev_val' decay recurrence of the mods"""
+    result = np.empty_like(values)
+    for idx in range(values.shape[0]):
+        val = values[idx]
+        if prev > val:
+            val = prev - (prev - val) / decays[idx]
+        result[idx] = val
+        prev = val
+    return result
+
+
+def spectrogram_bands(audio, frames, start=0):
+    """Return the (frames, frame_size // 2) matrix of spectrogram.band"""
+    spectre = SpectroGram(audio.blocksize)
+    bands = np.zeros((frames, audio.blocksize // 2))
+    for frame in range(frames):
+        buf = audio.get(start + frame)
+        if buf is None or len(buf) < audio.blocksize:
+            break
+        spectre.transform(buf)
+        bands[frame] = spectre.band
+    return bands
+
+
+def last_index(mask):
+    """Return the last True column of each row, -1 when there is none"""
+    last = mask.shape[1] - 1 - np.argmax(mask[:, ::-1], axis=1)
+    last[~mask.any(axis=1)] = -1
+    return last
+
+
+class AudioModBank:
+    """Evaluate AudioMods over a spectrogram matrix.
+
+    The mods state (prev_val) is updated, so that a timeline can also be
+    evaluated by consecutive chunks.
+    """
+    def __init__(self, mods):
+        self.mods = mods
+
+    def evaluate(self, bands):
+        return {name: self.evaluate_mod(mod, bands)
+                for name, mod in self.mods.items()}
+
+    def evaluate_mod(self, mod, bands):
+        band = bands[:, mod.band[0]:mod.band[1]]
+        if mod.mode == "high":
+            last = last_index(band > mod.threshold)
+            values = np.where(last > 0, last / mod.band_length, 0.)
+        elif mod.mode == "avg":
+            values = np.sum(band, axis=1) / band.shape[1]
+        elif mod.mode == "max":
+            values = np.max(band, axis=1)
+        elif mod.mode == "mean":
+            values = np.mean(band, axis=1)
+        else:
+            raise RuntimeError("%s: Unknown mode" % mod.mode)
+        values[(band == 0).all(axis=1)] = 0
+        values[values < mod.threshold] = 0
+        result = decay_scan(
+            values.astype(np.float64), np.full(len(values), float(mod.decay)),
+            float(mod.prev_val))
+        if len(result):
+            mod.prev_val = result[-1]
+        return result
+
+
+class MidiModBank:
+    """Evaluate MidiMods over per track note matrices.
+
+    tracks is a list of (name, notes, active) in the midi file track order,
+    where notes is a (frames, 128) uint8 matrix with 0 for no note and
+    velocity + 1 otherwise, and active is a (frames,) boolean array set when
+    the track has any event on a frame.
+    """
+    def __init__(self, mods):
+        self.mods = mods
+
+    def evaluate(self, tracks):
+        return {name: self.evaluate_mod(mod, tracks)
+                for name, mod in self.mods.items()}
+
+    def evaluate_mod(self, mod, tracks):
+        if mod.event != "chords":
+            raise RuntimeError("%s: Only chords event are supported" % (
+                mod.event))
+        frames = len(tracks[0][2]) if tracks else 0
+        values = np.zeros(frames)
+        # The event velocity changes the decay of pitch mod, nan means no
+        # change
+        decays = np.full(frames, np.nan)
+        taken = np.zeros(frames, dtype=bool)
+        for track, notes, active in tracks:
+            if track not in mod.track:
+                continue
+            # Only the first selected track with events is used
+            rows = np.nonzero(active & ~taken)[0]
+            taken |= active
+            on = notes[rows] > 0
+            if mod.mod == "pitch":
+                pitch = last_index(on)
+                rows, pitch = rows[pitch >= 0], pitch[pitch >= 0]
+                values[rows] = pitch / 127.0
+                decays[rows] = (notes[rows, pitch] - 1.) / mod.master_decay
+            elif mod.mod == "one-off":
+                values[rows[on.any(axis=1)]] = 1
+            elif mod.mod.startswith("ev-"):
+                pitches = list(map(int, mod.mod.split('-')[1:]))
+                values[rows[on[:, pitches].any(axis=1)]] = 1
+        # Forward fill the decay changes
+        changes = np.nonzero(~np.isnan(decays))[0]
+        decays = np.concatenate(([mod.decay], decays[changes]))[
+            np.searchsorted(changes, np.arange(frames), side='right')]
+        result = decay_scan(values, decays, float(mod.prev_val))
+        if frames:
+            mod.prev_val = result[-1]
+            mod.decay = decays[-1]
+        return result
@@ -10,10 +10,17 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import atexit
 import copy
+import json
+import os
 import pprint
+import subprocess
+import sys
 import time
+from multiprocessing import resource_tracker, shared_memory
 
+import numpy as np
 import pygame
 import pygame.locals
 try:
@@ -105,9 +112,178 @@ CODE2KEY = {}
 for k, v in KEY2CODE.items():
     CODE2KEY[v] = k
 
+# The parameters are mirrored to the sliders at most every MIRROR_INTERVAL
+# seconds, and the slider process polls them every POLL_INTERVAL ms
+MIRROR_INTERVAL = 0.1
+POLL_INTERVAL = 20
+
+
+class ParamBlock:
+    """The slider values shared by the renderer and the slider process.
+
+    The sliders region has a stamp per slot, incremented by the slider
+    process when the slot is set. The mirror region holds the parameters
+    values set by the renderer. Each region has a sequence number, odd while
+    it is written, so that a reader detects a change in O(1) and never uses
+    a partially written copy.
+    """
+    SLIDERS = 0
+    MIRROR = 1
+
+    def __init__(self, size, name=None):
+        if name is None:
+            self.shm = shared_memory.SharedMemory(
+                create=True, size=16 + 24 * max(size, 1))
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            # The renderer owns the block
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+        self.name = self.shm.name
+        self.sequences = np.ndarray((2,), np.int64, buffer=self.shm.buf)
+        self.stamps = np.ndarray(
+            (size,), np.int64, buffer=self.shm.buf, offset=16)
+        self.values = np.ndarray(
+            (2, size), np.float64, buffer=self.shm.buf, offset=16 + 8 * size)
+
+    def write(self, region, values, slot=slice(None)):
+        self.sequences[region] += 1
+        self.values[region, slot] = values
+        if region == self.SLIDERS:
+            self.stamps[slot] += 1
+        self.sequences[region] += 1
+
+    def read(self, region, sequence):
+        """Return the (sequence, values, stamps) of a region written after
+        sequence, None otherwise"""
+        for retry in range(100):
+            start = int(self.sequences[region])
+            if start == sequence:
+                return None
+            if start & 1:
+                continue
+            values = self.values[region].copy()
+            stamps = self.stamps.copy()
+            if int(self.sequences[region]) == start:
+                return start, values, stamps
+        return None
+
+    def close(self, unlink=False):
+        # The buffer can't be released while arrays use it
+        del self.sequences, self.stamps, self.values
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class SliderPanel:
+    """The tkinter sliders, running in their own process"""
+    def __init__(self, name, layout):
+        self.block = ParamBlock(len(layout), name)
+        self.parent = os.getppid()
+        self.root = tkinter.Tk()
+        self.controllers = []
+        self.width = 900
+        self.dragging = None
+        self.mirror_sequence = 0
+        self.mirrored = np.full(len(layout), np.nan)
+        for slot in layout:
+            if slot[0] == "fine":
+                self.add_fine(slot[1])
+            else:
+                self.add_float(slot[1], *slot[2:])
+
+    def run(self):
+        self.poll()
+        try:
+            self.root.mainloop()
+        finally:
+            self.block.close()
+
+    def poll(self):
+        if os.getppid() != self.parent:
+            # The renderer is gone
+            self.root.destroy()
+            return
+        mirror = self.block.read(ParamBlock.MIRROR, self.mirror_sequence)
+        if mirror:
+            self.mirror_sequence, values, _ = mirror
+            for slot, value in enumerate(values):
+                if slot != self.dragging and value != self.mirrored[slot]:
+                    self.set_slider(slot, value)
+            self.mirrored = values
+        self.root.after(POLL_INTERVAL, self.poll)
+
+    def set_slider(self, slot, value):
+        t, n, v = self.controllers[slot]
+        if t == "fine":
+            val, magnitude = list(map(lambda x: int(x.split('.')[0]),
+                                      "{:1e}".format(value).split('e')))
+            v[0].set(val)
+            v[1].set(magnitude)
+        else:
+            v.set(value)
+
+    def _get_row(self):
+        row = 0
+        for controller in self.controllers:
+            if controller[0] == "fine":
+                row += 2
+            else:
+                row += 1
+        return row
+
+    def bind(self, param, slot):
+        param.bind("<ButtonPress-1>", lambda ev: self.on_press(slot))
+        param.bind("<ButtonRelease-1>", lambda ev: self.on_tkclic(slot))
+
+    def add_float(self, name, from_, to, resolution=1):
+        """Add simple slider"""
+        r = self._get_row()
+
+        param = tkinter.Scale(self.root,
+                              from_=from_, to=to, resolution=resolution,
+                              orient=tkinter.HORIZONTAL, length=self.width)
+        tkinter.Label(self.root, text=name).grid(row=r, column=0)
+        param.grid(row=r, column=1)
+        self.bind(param, len(self.controllers))
+        self.controllers.append(["float", name, param])
+
+    def add_fine(self, name):
+        """Add 2 sliders, one for value, one for magnitude order"""
+        r = self._get_row()
+        param = tkinter.Scale(self.root,
+                              from_=0, to=10, resolution=1,
+                              orient=tkinter.HORIZONTAL, length=self.width)
+        tkinter.Label(self.root, text='%s value' % name).grid(row=r, column=0)
+        param.grid(row=r, column=1)
+        self.bind(param, len(self.controllers))
+
+        param_mag = tkinter.Scale(self.root,
+                                  from_=-15, to=15, resolution=1,
+                                  orient=tkinter.HORIZONTAL, length=self.width)
+        tkinter.Label(self.root, text='%s mag' % name).grid(row=r+1, column=0)
+        param_mag.grid(row=r+1, column=1)
+        self.bind(param_mag, len(self.controllers))
+        self.controllers.append(["fine", name, (param, param_mag)])
+
+    def on_press(self, slot):
+        # Don't move the slider under the mouse
+        self.dragging = slot
+
+    def on_tkclic(self, slot):
+        self.dragging = None
+        t, n, v = self.controllers[slot]
+        if t == "fine":
+            val = float("%de%d" % (v[0].get(), v[1].get()))
+        else:
+            val = v.get()
+        self.mirrored[slot] = val
+        self.block.write(ParamBlock.SLIDERS, val, slot)
+
 
 class Controller:
-    def __init__(self, params, variant=None, default=DEFAULT_PARAMETERS):
+    def __init__(self, params, variant=None, default=DEFAULT_PARAMETERS,
+                 gui=True):
         for k, v in default.items():
             if k not in params:
                 params[k] = v
@@ -136,28 +312,58 @@ class Controller:
             elif mod_param.get("type") == "ratio":
                 self.keymaps[keys[0]] = [mod, "mul", (res+1)/res]
                 self.keymaps[keys[1]] = [mod, "mul", (res-1)/res]
-        if not tk_ftw or not params["mods"]:
-            self.root = None
-            return
-        self.root = tkinter.Tk()
-        self.controllers = []
-        self.width = 900
-        self.location_pos = 0
+        # The (name, index) of the sliders parameters
+        self.slots = []
+        layout = []
         for mod, mod_param in self.params["mods"].items():
             if not mod_param.get("sliders"):
                 continue
             if mod_param.get("type") == "fine":
-                self.add_fine(mod)
+                self.slots.append((mod, None))
+                layout.append(["fine", mod])
             elif mod_param.get("type") == "vec3":
-                self.add_vec3(mod, mod_param)
+                for idx, axis in enumerate("xyz"):
+                    self.slots.append((mod, idx))
+                    layout.append(["float", "%s_%s" % (mod, axis),
+                                   mod_param["min"], mod_param["max"],
+                                   mod_param["resolution"]])
             else:
-                self.add_float(mod,
-                               mod_param["min"], mod_param["max"],
-                               mod_param["resolution"])
+                self.slots.append((mod, None))
+                layout.append(["float", mod, mod_param["min"],
+                               mod_param["max"], mod_param["resolution"]])
+        self.root = None
+        self.block = None
+        self.process = None
+        if not gui or not tk_ftw or not self.slots:
+            return
+        # The sliders run in their own process so that tk never blocks the
+        # render loop
+        self.block = ParamBlock(len(self.slots))
+        self.mirrored = self.slider_values()
+        self.mirror_time = 0
+        # Set when the parameters changed within MIRROR_INTERVAL of the
+        # last write, poll() writes them once the interval is over
+        self.mirror_pending = False
+        self.block.write(ParamBlock.MIRROR, self.mirrored)
+        self.stamps = self.block.stamps.copy()
+        self.sliders_sequence = int(self.block.sequences[ParamBlock.SLIDERS])
+        # hy scripts run with the hy executable
+        executable = getattr(sys.modules.get("hy"), "sys_executable",
+                             sys.executable)
+        self.process = subprocess.Popen(
+            [executable, os.path.abspath(__file__), self.block.name,
+             json.dumps(layout)],
+            env=dict(os.environ, PYGAME_HIDE_SUPPORT_PROMPT="1"))
+        atexit.register(self.close)
 
-        # Give tcl/tk sometime to reserve resources
-        self.root.update()
-        time.sleep(0.23)
+    def close(self):
+        if self.process:
+            self.process.terminate()
+            self.process.wait()
+            self.process = None
+        if self.block:
+            self.block.close(unlink=True)
+            self.block = None
 
     def set(self, screen, scene):
         """Set provided params"""
@@ -165,100 +371,58 @@ class Controller:
         self.scene = scene
         self.update_sliders()
 
+    def slider_values(self):
+        return np.array([
+            self.params[name] if idx is None else self.params[name][idx]
+            for name, idx in self.slots], np.float64)
+
     def update_sliders(self):
-        # Set sliders position
-        if not self.root:
+        """Mirror the parameters to the sliders, at most every
+        MIRROR_INTERVAL"""
+        if not self.block:
             return
-        for t, n, v in self.controllers:
-            if t == "vec3":
-                n, i = n.split('_')
-                if i == "x":
-                    idx = 0
-                elif i == "y":
-                    idx = 1
-                elif i == "z":
-                    idx = 2
-                else:
-                    raise RuntimeError("%s: Unknown vec3 idx" % i)
-                value = self.params[n][idx]
-            else:
-                value = self.params[n]
-            if t == "float" or t == "vec3":
-                v.set(value)
-            else:
-                val, magnitude = list(map(lambda x: int(x.split('.')[0]),
-                                          "{:1e}".format(value).split('e')))
-                v[0].set(val)
-                v[1].set(magnitude)
+        self.mirror_pending = True
+        self.flush_sliders()
 
-        self.root.update()
+    def flush_sliders(self):
+        """Write the pending mirror once MIRROR_INTERVAL passed"""
+        now = time.monotonic()
+        if not self.mirror_pending or now - self.mirror_time < MIRROR_INTERVAL:
+            return
+        self.mirror_pending = False
+        self.mirror_time = now
+        values = self.slider_values()
+        if not np.array_equal(values, self.mirrored):
+            self.mirrored = values
+            self.block.write(ParamBlock.MIRROR, values)
 
-    def _get_row(self):
-        row = 0
-        for controller in self.controllers:
-            if controller[0] == "fine":
-                row += 2
+    def poll(self):
+        """Apply the sliders changes, return True when a parameter changed"""
+        if not self.block:
+            return False
+        sliders = self.block.read(ParamBlock.SLIDERS, self.sliders_sequence)
+        if sliders is None:
+            self.flush_sliders()
+            return False
+        self.sliders_sequence, values, stamps = sliders
+        changed = np.nonzero(stamps != self.stamps)[0]
+        self.stamps = stamps
+        for slot in changed:
+            name, idx = self.slots[slot]
+            old = self.params[name] if idx is None else self.params[name][idx]
+            value = float(values[slot])
+            if isinstance(old, int) and value.is_integer():
+                value = int(value)
+            if idx is None:
+                self.params[name] = value
             else:
-                row += 1
-        return row
-
-    def add_float(self, name, from_, to, resolution=1, ttype="float"):
-        """Add simple slider"""
-        r = self._get_row()
-
-        param = tkinter.Scale(self.root,
-                              from_=from_, to=to, resolution=resolution,
-                              orient=tkinter.HORIZONTAL, length=self.width)
-        tkinter.Label(self.root, text=name).grid(row=r, column=0)
-        param.grid(row=r, column=1)
-        param.bind("<ButtonRelease-1>", self.on_tkclic)
-        self.controllers.append([ttype, name, param])
-
-    def add_fine(self, name):
-        """Add 2 sliders, one for value, one for magnitude order"""
-        r = self._get_row()
-        param = tkinter.Scale(self.root,
-                              from_=0, to=10, resolution=1,
-                              orient=tkinter.HORIZONTAL, length=self.width)
-        tkinter.Label(self.root, text='%s value' % name).grid(row=r, column=0)
-        param.grid(row=r, column=1)
-        param.bind("<ButtonRelease-1>", self.on_tkclic)
-
-        param_mag = tkinter.Scale(self.root,
-                                  from_=-15, to=15, resolution=1,
-                                  orient=tkinter.HORIZONTAL, length=self.width)
-        tkinter.Label(self.root, text='%s mag' % name).grid(row=r+1, column=0)
-        param_mag.grid(row=r+1, column=1)
-        param_mag.bind("<ButtonRelease-1>", self.on_tkclic)
-        self.controllers.append(["fine", name, (param, param_mag)])
-
-    def add_vec3(self, name, mod_params):
-        """Add vec3 sliders"""
-        self.add_float(name + "_x", mod_params["min"], mod_params["max"],
-                       resolution=mod_params["resolution"], ttype="vec3")
-        self.add_float(name + "_y", mod_params["min"], mod_params["max"],
-                       resolution=mod_params["resolution"], ttype="vec3")
-        self.add_float(name + "_z", mod_params["min"], mod_params["max"],
-                       resolution=mod_params["resolution"], ttype="vec3")
-
-    def on_tkclic(self, ev=None):
-        # Read all sliders values
-        for t, n, v in self.controllers:
-            if t == "fine":
-                val = float("%de%d" % (v[0].get(), v[1].get()))
-                self.params[n] = val
-            if t == "float":
-                self.params[n] = v.get()
-            if t == "vec3":
-                n, i = n.split('_')
-                if i == "x":
-                    idx = 0
-                elif i == "y":
-                    idx = 1
-                elif i == "z":
-                    idx = 2
-                self.params[n][idx] = v.get()
-        self.scene.draw = True
+                self.params[name][idx] = value
+            # The slider already shows the value
+            self.mirrored[slot] = values[slot]
+        if len(changed) and getattr(self, "scene", None):
+            self.scene.draw = True
+        self.flush_sliders()
+        return bool(len(changed))
 
     def on_pygame_clic(self, ev):
         plane_coord = self.scene.convert_to_plane(ev.pos)
@@ -327,12 +491,16 @@ class Controller:
         elif key == 'o':
             from . dialog import NameDialog
             self.last_key_press = None
-            diag = NameDialog(self.root)
+            # The sliders root is in another process
+            root = tkinter.Tk()
+            root.withdraw()
+            diag = NameDialog(root)
             if diag.name:
                 import yaml
                 data = {'variant': {diag.name: self.get()}}
                 print(yaml.dump(data, default_flow_style=False))
             diag.destroy()
+            root.destroy()
             self.scene.draw = False
         elif key == 'SPACE':
             self.paused = not self.paused
@@ -369,8 +537,7 @@ class Controller:
             main = self.screen.windows[0]
             self.screen.windows = [main, (self.scene.map_scene, (0, 0))]
 
-        if self.root:
-            self.root.update()
+        self.poll()
         for ev in pygame.event.get():
             if ev.type == pygame.locals.KEYDOWN:
                 self.last_key_press = ev.dict['scancode']
@@ -399,3 +566,7 @@ class Controller:
 
     def get_c(self):
         return complex(self.params["c_real"], self.params["c_imag"])
+
+
+if __name__ == "__main__":
+    SliderPanel(sys.argv[1], json.loads(sys.argv[2])).run()
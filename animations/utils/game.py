@@ -10,13 +10,22 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import numpy as np
 import pygame
+import pygame.gfxdraw
 
 
 def clock():
     return pygame.time.Clock()
 
 
+def batch(length, *arrays):
+    """Convert drawing arrays to lists of int, broadcasting the scalars"""
+    return [np.broadcast_to(np.asarray(array).astype(int),
+                            (length,) + np.shape(array)[1:]).tolist()
+            for array in arrays]
+
+
 class Screen:
     def __init__(self, screen_size):
         pygame.init()
@@ -68,6 +77,35 @@ class Window:
     def draw_circle(self, coord, size, color=(28, 28, 28)):
         pygame.draw.circle(self.surface, color, coord, size)
 
+    def draw_lines(self, starts, ends, colors, widths=1, antialias=False):
+        """Draw many lines from (n, 2) coordinates and (n, 3) rgb colors
+        arrays. Antialiased lines are one pixel wide.
+
+        The arrays are converted in one go, but each line is still drawn by
+        pygame: rasterizing all the pixels with numpy is an order of
+        magnitude slower than the SDL primitives.
+        """
+        starts, ends, colors, widths = batch(
+            len(starts), starts, ends, colors, widths)
+        if antialias:
+            for start, end, color in zip(starts, ends, colors):
+                pygame.draw.aaline(self.surface, color, start, end)
+            return
+        for start, end, color, width in zip(starts, ends, colors, widths):
+            pygame.draw.line(self.surface, color, start, end, width)
+
+    def draw_circles(self, centers, radii, colors, antialias=False):
+        """Draw many filled circles, see draw_lines"""
+        centers, radii, colors = batch(len(centers), centers, radii, colors)
+        if antialias:
+            for (x, y), radius, color in zip(centers, radii, colors):
+                pygame.gfxdraw.aacircle(self.surface, x, y, radius, color)
+                pygame.gfxdraw.filled_circle(
+                    self.surface, x, y, radius, color)
+            return
+        for center, radius, color in zip(centers, radii, colors):
+            pygame.draw.circle(self.surface, color, center, radius)
+
     def draw_point(self, coord, color=[242]*3, width=1):
         if width > 1:
             self.draw_circle(coord, width, color)
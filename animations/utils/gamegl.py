@@ -12,22 +12,284 @@
 
 import argparse
 import collections
+import concurrent.futures
+import ctypes
+import hashlib
 import json
 import time
 import math
 import os
+import queue
+import re
+import struct
+import sys
+import threading
+import zlib
 import numpy as np
 import copy
 from PIL import Image
 
+# for headless rendering, the platform is read when OpenGL is imported
+if "--headless" in sys.argv:
+    os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+
 from glumpy import app, gl, glm, gloo
 from glumpy.app.window import key
 from glumpy.app.window.event import EventDispatcher
+# glumpy's gl doesn't expose the pixel buffer functions
+from OpenGL import GL
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
 
 from . controller import Controller
-from . audio import Audio, NoAudio, SpectroGram
+from . audio import AUDIO_SYNC, Audio, NoAudio, SpectroGram
 from . midi import Midi, NoMidi
 
+# Number of pixel buffers of the recorder, frames are read PBO_COUNT - 1
+# frames after they are rendered
+PBO_COUNT = 3
+ENCODE_WORKERS = os.cpu_count()
+# Size of the tiles of the poster rendering
+TILE_SIZE = 512
+# The fragment coordinate of the tiled programs
+TILE_HEADER = """uniform vec2 iTileOffset;
+#define tile_FragCoord (gl_FragCoord + vec4(iTileOffset, 0., 0.))
+"""
+# Adaptive resolution: the render scale while the input is active, and
+# the number of samples accumulated once idle
+MIN_SCALE = 0.1
+INTERACTION_DELAY = 0.3
+ACCUMULATION_SAMPLES = 16
+# The shader watcher polling interval when watchdog isn't available
+WATCH_INTERVAL = 0.25
+# The linked program binaries, keyed by the driver and the final source
+PROGRAM_CACHE = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "demo-render", "programs")
+
+
+class ParamVector(list):
+    """A list parameter reporting its in-place changes to the store"""
+    def __init__(self, store, key, values):
+        super().__init__(values)
+        self.store = store
+        self.key = key
+
+    def __setitem__(self, idx, value):
+        super().__setitem__(idx, value)
+        self.store.touch(self.key)
+
+    def __reduce_ex__(self, protocol):
+        # Copies are plain lists
+        return (list, (list(self),))
+
+
+class ParamStore(dict):
+    """The scene parameters, with the version of their last change.
+
+    Each consumer keeps the version it has seen and asks for the keys
+    changed since, the cost is proportional to the number of changes.
+    Values modified in place, other than lists, need to be touched.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self.version = 0
+        self.versions = {}
+        self.log = []
+        self.update(*args, **kwargs)
+
+    def __setitem__(self, key, value):
+        if key in self and self.same(super().__getitem__(key), value):
+            return
+        if isinstance(value, list) and not isinstance(value, ParamVector):
+            value = ParamVector(self, key, value)
+        super().__setitem__(key, value)
+        self.touch(key)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.touch(key)
+
+    def __reduce_ex__(self, protocol):
+        return (dict, (dict(self),))
+
+    @staticmethod
+    def same(old, new):
+        if old is new:
+            return isinstance(new, (int, float, str, tuple))
+        try:
+            return bool(old == new)
+        except ValueError:
+            return np.array_equal(old, new)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for name, value in dict(*args, **kwargs).items():
+            self[name] = value
+
+    def touch(self, key):
+        self.version += 1
+        self.versions[key] = self.version
+        self.log.append((self.version, key))
+        if len(self.log) > 4 * len(self.versions) + 64:
+            # Only the last change of each key matters
+            self.log = sorted((version, name)
+                              for name, version in self.versions.items())
+
+    def changed_since(self, version):
+        """Return the keys changed after version"""
+        changed = set()
+        for idx in range(len(self.log) - 1, -1, -1):
+            if self.log[idx][0] <= version:
+                break
+            changed.add(self.log[idx][1])
+        return changed
+
+
+def save_frame(data, size, filename):
+    # The GL rows are bottom up, the negative stride flips at decode time
+    image = Image.frombytes("RGB", size, data, "raw", "RGB", 0, -1)
+    image.save(filename, 'png')
+
+
+class PngWriter:
+    """Write a png by bands of rows, to stream images bigger than memory"""
+    def __init__(self, fobj, width, height):
+        self.fobj = fobj
+        self.compressor = zlib.compressobj()
+        fobj.write(b"\x89PNG\r\n\x1a\n")
+        self.chunk(b"IHDR", struct.pack(
+            ">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+    def chunk(self, kind, data):
+        self.fobj.write(struct.pack(">I", len(data)) + kind + data +
+                        struct.pack(">I", zlib.crc32(kind + data)))
+
+    def write(self, rows):
+        """Write a (rows, width, 3) uint8 array, top row first"""
+        # Each row starts with the filter type, 0 is no filter
+        filtered = np.zeros((len(rows), rows[0].size + 1), np.uint8)
+        filtered[:, 1:] = rows.reshape(len(rows), -1)
+        data = self.compressor.compress(filtered.tobytes())
+        if data:
+            self.chunk(b"IDAT", data)
+
+    def close(self):
+        self.chunk(b"IDAT", self.compressor.flush())
+        self.chunk(b"IEND", b"")
+
+
+def sample_offsets(samples):
+    """Sub-pixel jitter offsets in [-0.5, 0.5), from the R2 sequence"""
+    if samples == 1:
+        return np.zeros((1, 2))
+    plastic = 1.32471795724474602596
+    steps = np.arange(samples)[:, np.newaxis]
+    return (0.5 + steps / np.array([plastic, plastic ** 2])) % 1 - 0.5
+
+
+class GpuTimer:
+    """Measure the GPU duration of draw calls without waiting for them"""
+    def __init__(self):
+        self.queries = list(GL.glGenQueries(2))
+        self.pending = [False, False]
+        self.index = 0
+
+    def begin(self):
+        GL.glBeginQuery(GL.GL_TIME_ELAPSED, self.queries[self.index])
+
+    def end(self):
+        GL.glEndQuery(GL.GL_TIME_ELAPSED)
+        self.pending[self.index] = True
+        self.index = 1 - self.index
+
+    def elapsed(self):
+        """Return the previous measure in seconds, None when not ready"""
+        query = self.queries[self.index]
+        if not self.pending[self.index] or not GL.glGetQueryObjectiv(
+                query, GL.GL_QUERY_RESULT_AVAILABLE):
+            return None
+        self.pending[self.index] = False
+        return GL.glGetQueryObjectui64v(query, GL.GL_QUERY_RESULT) / 1e9
+
+
+def blit(framebuffer, source, destination):
+    """Scale the framebuffer source size to the window destination size"""
+    GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, framebuffer.handle)
+    GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, 0)
+    GL.glBlitFramebuffer(0, 0, source[0], source[1],
+                         0, 0, destination[0], destination[1],
+                         GL.GL_COLOR_BUFFER_BIT, GL.GL_LINEAR)
+    GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, 0)
+
+
+class FrameRecorder:
+    """Capture frames without stalling the render loop.
+
+    glReadPixels is done into a ring of pixel buffer objects, so that the
+    copy happens asynchronously on the GPU, and a buffer is only mapped when
+    it comes back around, once the following frames have been issued.
+    The png encoding is done by a pool of worker threads.
+    """
+    def __init__(self, size, count=PBO_COUNT, workers=ENCODE_WORKERS,
+                 sink=save_frame):
+        self.size = tuple(size)
+        self.sink = sink
+        self.nbytes = self.size[0] * self.size[1] * 3
+        self.buffers = [GL.glGenBuffers(1) for _ in range(count)]
+        for buffer in self.buffers:
+            GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, buffer)
+            GL.glBufferData(GL.GL_PIXEL_PACK_BUFFER, self.nbytes, None,
+                            GL.GL_STREAM_READ)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        self.index = 0
+        self.pending = collections.deque()
+        self.pool = concurrent.futures.ThreadPoolExecutor(workers)
+        self.jobs = collections.deque()
+        self.max_jobs = 2 * workers
+
+    def capture(self, filename):
+        buffer = self.buffers[self.index]
+        self.index = (self.index + 1) % len(self.buffers)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, buffer)
+        GL.glPixelStorei(GL.GL_PACK_ALIGNMENT, 1)
+        GL.glReadPixels(0, 0, self.size[0], self.size[1],
+                        GL.GL_RGB, GL.GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        self.pending.append((buffer, filename))
+        if len(self.pending) == len(self.buffers):
+            self.retire()
+
+    def retire(self):
+        buffer, filename = self.pending.popleft()
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, buffer)
+        address = GL.glMapBuffer(GL.GL_PIXEL_PACK_BUFFER, GL.GL_READ_ONLY)
+        data = ctypes.string_at(address, self.nbytes)
+        GL.glUnmapBuffer(GL.GL_PIXEL_PACK_BUFFER)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        # Bound the encoding queue memory
+        while len(self.jobs) >= self.max_jobs:
+            self.jobs.popleft().result()
+        self.jobs.append(
+            self.pool.submit(self.sink, data, self.size, filename))
+
+    def close(self):
+        while self.pending:
+            self.retire()
+        while self.jobs:
+            self.jobs.popleft().result()
+        self.pool.shutdown()
+        GL.glDeleteBuffers(len(self.buffers),
+                           np.array(self.buffers, dtype=np.uint32))
+
 
 class Window(EventDispatcher):
     alive = True
@@ -39,6 +301,7 @@ class Window(EventDispatcher):
         self.init_program()
         self.fbuffer = np.zeros(
             (self.window.height, self.window.width * 3), dtype=np.uint8)
+        self.recorder = None
         super().__init__()
 
     def capture(self, filename):
@@ -48,6 +311,20 @@ class Window(EventDispatcher):
         image = Image.frombytes("RGB", self.winsize, np.ascontiguousarray(np.flip(self.fbuffer, 0)))
         image.save(filename, 'png')
 
+    def record(self, filename):
+        """Asynchronous capture, call stop_record to write the last frames"""
+        size = (self.window.width, self.window.height)
+        if self.recorder and self.recorder.size != size:
+            self.stop_record()
+        if not self.recorder:
+            self.recorder = FrameRecorder(size)
+        self.recorder.capture(filename)
+
+    def stop_record(self):
+        if self.recorder:
+            self.recorder.close()
+            self.recorder = None
+
     def on_draw(self, dt):
         pass
 
@@ -62,7 +339,10 @@ class Window(EventDispatcher):
         self.draw = True
 
 
-def fragment_loader(fragment: str, export: bool, filename=None):
+def fragment_loader(fragment: str, export: bool, filename=None,
+                    includes=None):
+    """Return the final fragment source and its uniforms. The path of the
+    included files are appended to the includes list"""
     final = []
     uniforms = {"mods": {}}
     shadertoy = False
@@ -70,9 +350,11 @@ def fragment_loader(fragment: str, export: bool, filename=None):
     def loader(lines: list):
         for line in lines:
             if line.startswith("#include"):
-                loader(open(os.path.join(os.path.dirname(filename),
-                                         line.split()[1][1:-1])
-                            ).read().split('\n'))
+                include = os.path.join(os.path.dirname(filename),
+                                       line.split()[1][1:-1])
+                if includes is not None:
+                    includes.append(include)
+                loader(open(include).read().split('\n'))
             else:
                 export_line = ""
                 if line.lstrip().startswith('uniform'):
@@ -135,6 +417,170 @@ void main(void) {mainImage(gl_FragColor, gl_FragCoord.xy);}""")
     return "\n".join(final), uniforms
 
 
+class ShaderWatcher(threading.Thread):
+    """Watch a fragment file and its includes, the modified fragment is
+    parsed in the background and queued in results"""
+    def __init__(self, path, includes):
+        super().__init__(daemon=True)
+        self.path = path
+        self.results = queue.Queue()
+        self.changed = threading.Event()
+        self.observer = None
+        self.watch(includes)
+
+    @staticmethod
+    def stat(paths):
+        mtimes = {}
+        for path in paths:
+            try:
+                mtimes[path] = os.stat(path).st_mtime
+            except OSError:
+                mtimes[path] = None
+        return mtimes
+
+    def watch(self, includes, mtimes=None):
+        if mtimes is None:
+            mtimes = self.stat([self.path] + includes)
+        self.mtimes = {path: mtimes[path] for path in [self.path] + includes}
+        if self.observer:
+            self.schedule()
+
+    def parse(self):
+        # Take the mtimes before reading, so that a save landing during the
+        # parse is still seen as a modification
+        mtimes = self.stat(self.mtimes)
+        while True:
+            includes = []
+            try:
+                fragment = open(self.path).read()
+                result = fragment_loader(fragment, False, self.path, includes)
+            except (OSError, RuntimeError, ValueError, IndexError) as e:
+                print("%s: %s" % (self.path, e))
+                result = None
+            new = [path for path in includes if path not in mtimes]
+            if not new:
+                break
+            # A new include was read before its mtime was taken
+            mtimes.update(self.stat(new))
+        self.watch(includes, mtimes)
+        return result
+
+    def modified(self):
+        for path, mtime in self.mtimes.items():
+            try:
+                if os.stat(path).st_mtime != mtime:
+                    return True
+            except OSError:
+                if mtime is not None:
+                    return True
+        return False
+
+    def schedule(self):
+        self.observer.unschedule_all()
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                watcher.changed.set()
+        for directory in {os.path.dirname(os.path.abspath(path))
+                          for path in self.mtimes}:
+            self.observer.schedule(Handler(), directory)
+
+    def run(self):
+        if Observer is not None:
+            self.observer = Observer()
+            self.schedule()
+            self.observer.start()
+        while True:
+            # The observer wakes up the thread, polling is the fallback
+            self.changed.wait(None if self.observer else WATCH_INTERVAL)
+            self.changed.clear()
+            if self.modified():
+                result = self.parse()
+                if result:
+                    self.results.put(result)
+
+
+def program_binary_key(vertex, fragment, version):
+    driver = [GL.glGetString(name) or b"" for name in (
+        GL.GL_VENDOR, GL.GL_RENDERER, GL.GL_VERSION)]
+    digest = hashlib.sha256(b"\0".join(driver))
+    for source in (version, vertex, fragment):
+        digest.update(b"\0" + source.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class CachedProgram(gloo.Program):
+    """A program linked from the binary cache when the source and the driver
+    didn't change"""
+    def __init__(self, vertex, fragment, count=0, version="450"):
+        super().__init__(vertex, fragment, count=count, version=version)
+        self.sources = (vertex, fragment, version)
+        self.cache_path = None
+
+    def _build_shaders(self, program):
+        # The binary is only retrievable when the hint is set before linking
+        GL.glProgramParameteri(
+            program, GL.GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL.GL_TRUE)
+        super()._build_shaders(program)
+
+    def _create(self):
+        self.cache_path = os.path.join(
+            PROGRAM_CACHE, program_binary_key(*self.sources) + ".bin")
+        if self.load_binary():
+            return
+        super()._create()
+        self.store_binary()
+
+    def load_binary(self):
+        try:
+            data = open(self.cache_path, "rb").read()
+        except OSError:
+            return False
+        if len(data) <= 4:
+            return False
+        binary_format, = struct.unpack("<I", data[:4])
+        self._handle = gl.glCreateProgram()
+        binary = ctypes.create_string_buffer(data[4:], len(data) - 4)
+        GL.glProgramBinary(self._handle, binary_format, binary, len(binary))
+        if not GL.glGetProgramiv(self._handle, GL.GL_LINK_STATUS):
+            # The driver rejected the binary, rebuild from the source
+            gl.glDeleteProgram(self._handle)
+            self._handle = -1
+            return False
+        # Same as gloo.Program._create after linking
+        active_uniforms = [name for (name, gtype) in self.active_uniforms]
+        for uniform in self._uniforms.values():
+            uniform.active = uniform.name in active_uniforms
+        active_attributes = [
+            name for (name, gtype) in self.active_attributes]
+        for attribute in self._attributes.values():
+            attribute.active = attribute.name in active_attributes
+        return True
+
+    def store_binary(self):
+        size = int(GL.glGetProgramiv(
+            self._handle, GL.GL_PROGRAM_BINARY_LENGTH))
+        if not size:
+            return
+        binary = ctypes.create_string_buffer(size)
+        length = GL.GLsizei()
+        binary_format = GL.GLenum()
+        GL.glGetProgramBinary(self._handle, size, ctypes.byref(length),
+                              ctypes.byref(binary_format), binary)
+        try:
+            os.makedirs(PROGRAM_CACHE, exist_ok=True)
+            # Write and rename so that a concurrent load never reads a
+            # partial binary
+            tmp_path = "%s.%d" % (self.cache_path, os.getpid())
+            with open(tmp_path, "wb") as f:
+                f.write(struct.pack("<I", binary_format.value))
+                f.write(binary.raw[:length.value])
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            print("Couldn't cache the program: %s" % e)
+
+
 class FragmentShader(Window):
     """A class to simplify raymarcher/DE experiment"""
     vertex = """
@@ -175,8 +621,17 @@ void main() {
 
     def __init__(self, args, fragment=None, winsize=None, title=None):
         self.fps = args.fps
-        self.record = args.record
+        self.headless = getattr(args, "headless", False)
+        self.adaptive = getattr(args, "adaptive", False) and not self.headless
+        self.frame_time = getattr(args, "frame_time", None) or 1 / args.fps
+        self.interaction = 0
+        self.scale = 1.
+        self.frame_costs = collections.deque(maxlen=8)
+        self.samples = 0
+        self.framebuffers = None
+        self.accumulation_program = None
         self.old_program = None
+        self.watcher = None
         if fragment is None:
             fragment = args.fragment
         if winsize:
@@ -188,8 +643,11 @@ void main() {
             self.program_params = set(self._params.keys()).intersection(
                 set(self.params.keys())) - {"mods"}
         else:
-            self.params = self._params
+            self.params = ParamStore(self._params)
             self.program_params = set(self._params.keys()) - {"mods"}
+        # The params version uploaded to the program and drawn
+        self.uploaded_version = 0
+        self.drawn_version = 0
         self.iMat = self.params.get("iMat")
         # Gimbal mode, always looking at the center
         self.gimbal = True
@@ -206,35 +664,45 @@ void main() {
             else:
                 self.position = np.array([.0, .0, 10.2])
         if title != "Map":
-            self.controller = Controller(self.params, default={})
+            self.controller = Controller(
+                self.params, default={}, gui=not self.headless)
         else:
             self.controller = None
-        self.screen = app.Window(
-            width=args.winsize[0], height=args.winsize[1], title=title)
+        if self.headless:
+            from . offscreen import OffscreenWindow
+            self.screen = OffscreenWindow(*args.winsize)
+        else:
+            self.screen = app.Window(
+                width=args.winsize[0], height=args.winsize[1], title=title)
         super().__init__(args.winsize, self.screen)
         if self.controller:
             self.controller.set(self.screen, self)
         self.screen.attach(self)
         self.paused = False
-        self.prev_params = {}
 
     def load_program(self, fragment_path, export=False):
         if os.path.exists(fragment_path):
             fragment = open(fragment_path).read()
             fn = fragment_path
             self.fragment_path = fragment_path
-            self.fragment_mtime = os.stat(fragment_path).st_mtime
         else:
             fragment = fragment_path
             fn = None
-            self.fragment_mtime = None
 
-        self.fragment, self._params = fragment_loader(fragment, export, fn)
-        self.iTime = "iTime" in self.fragment
-        self.iMouse = "iMouse" in self.fragment
+        includes = []
+        self.set_fragment(*fragment_loader(fragment, export, fn, includes))
         if export:
             print(self.fragment)
             exit(0)
+        if fn:
+            # The modifications are parsed in the background
+            self.watcher = ShaderWatcher(fn, includes)
+            self.watcher.start()
+
+    def set_fragment(self, fragment, params):
+        self.fragment, self._params = fragment, params
+        self.iTime = "iTime" in self.fragment
+        self.iMouse = "iMouse" in self.fragment
 
     def init_program(self):
         # Ensure size is set
@@ -242,7 +710,8 @@ void main() {
         #print("---[")
         #print(self.fragment)
         #print("]---")
-        self.program = gloo.Program(self.vertex, self.fragment, count=4, version="450")
+        self.program = CachedProgram(
+            self.vertex, self.fragment, count=4, version="450")
         self.program['position'] = [(-1, -1), (-1, +1), (+1, -1), (+1, +1)]
         if self.title == "Map":
             self.point_history = collections.deque(maxlen=250)
@@ -260,27 +729,33 @@ void main() {
         self.on_resize(*self.winsize)
         if self.iMouse:
             self.program["iMouse"] = self.iMouse
+        if self.accumulation_program:
+            self.accumulation_program.delete()
+            self.accumulation_program = None
+        self.samples = 0
+        # The new program needs all the uniforms
+        self.uploaded_version = 0
 
     def update(self, frame):
-        if self.fragment_mtime:
-            mtime = os.stat(self.fragment_path).st_mtime
-            if mtime > self.fragment_mtime:
-                self.old_program = self.program
-                self.load_program(self.fragment_path)
-                self.init_program()
-        if self.controller and self.controller.root:
-            self.controller.root.update()
+        if self.watcher and not self.watcher.results.empty():
+            self.old_program = self.program
+            self.set_fragment(*self.watcher.results.get())
+            self.init_program()
+        if self.controller:
+            self.controller.poll()
         if self.title == "Map":
             # Check for new seed position
             if not len(self.point_history) or \
                self.point_history[-1] != self.params["seed"]:
                 self.add_point(copy.copy(self.params["seed"]))
                 self.draw = True
-        try:
-            if self.prev_params != self.params:
-                self.draw = True
-        except ValueError:
-            pass
+        if self.params.changed_since(self.drawn_version):
+            self.draw = True
+            self.samples = 0
+            if self.controller:
+                # Keyboard and mouse changes reach the sliders even when
+                # paused
+                self.controller.update_sliders()
         if self.paused:
             return self.draw
         self.draw = True
@@ -301,14 +776,14 @@ void main() {
                 glm.xrotate(self.iMat, self.params["horizontal_angle"])
                 glm.yrotate(self.iMat, self.params["vertical_angle"])
             self.params["iMat"] = self.iMat
-        for p in self.program_params:
-            self.program[p] = self.params[p]
-        dt = dt / self.fps
-
-        if self.iTime:
-            self.program["iTime"] = dt
+        changed = self.params.changed_since(self.uploaded_version)
+        self.uploaded_version = self.params.version
+        self.set_uniforms(self.program, dt, changed)
         try:
-            self.program.draw(gl.GL_TRIANGLE_STRIP)
+            if self.adaptive:
+                self.draw_adaptive(dt)
+            else:
+                self.program.draw(gl.GL_TRIANGLE_STRIP)
             if self.old_program:
                 self.old_program.delete()
                 del self.old_program
@@ -322,13 +797,143 @@ void main() {
             del self.program
             self.program = self.old_program
             self.old_program = None
+            self.uploaded_version = 0
             self.paused = True
 
         if self.title == "Map":
             gl.glEnable(gl.GL_BLEND)
             gl.glBlendFunc(gl.GL_ONE_MINUS_DST_COLOR, gl.GL_ZERO)
             self.point_program.draw(gl.GL_POINTS)
-        self.prev_params = copy.deepcopy(self.params)
+        self.drawn_version = self.params.version
+
+    def set_uniforms(self, program, frame, keys=None):
+        """Upload the parameters, or only the keys when provided"""
+        if keys is not None:
+            keys = keys & self.program_params
+        else:
+            keys = self.program_params
+        for p in keys:
+            program[p] = self.params[p]
+        if self.iTime:
+            program["iTime"] = frame / self.fps
+
+    def tiled_program(self):
+        """Return the program with the fragment coordinate offset by the
+        iTileOffset uniform"""
+        fragment = re.sub(r"\bgl_FragCoord\b", "tile_FragCoord",
+                          self.fragment)
+        program = gloo.Program(
+            self.vertex, TILE_HEADER + fragment, count=4, version="450")
+        program['position'] = [(-1, -1), (-1, +1), (+1, -1), (+1, +1)]
+        if self.iMouse:
+            program["iMouse"] = self.iMouse
+        return program
+
+    def draw_adaptive(self, frame):
+        """Render at a lower resolution while the input is active, then
+        accumulate jittered full resolution samples"""
+        width, height = self.winsize
+        if self.framebuffers is None or \
+           self.framebuffers[0] != (width, height):
+            self.framebuffers = ((width, height), gloo.FrameBuffer(
+                color=[np.zeros((height, width, 4), np.uint8).view(
+                    gloo.Texture2D)]), gloo.FrameBuffer(
+                color=[np.zeros((height, width, 4), np.float32).view(
+                    gloo.TextureFloat2D)]))
+            self.timer = GpuTimer()
+            self.samples = 0
+        _, lowres, accumulation = self.framebuffers
+        if time.monotonic() - self.interaction < INTERACTION_DELAY:
+            elapsed = self.timer.elapsed()
+            if elapsed:
+                # The cost of a full resolution frame
+                self.frame_costs.append(elapsed / self.scale ** 2)
+                self.scale = float(np.clip(
+                    math.sqrt(self.frame_time / np.median(self.frame_costs)),
+                    MIN_SCALE, 1))
+            size = (max(1, int(width * self.scale)),
+                    max(1, int(height * self.scale)))
+            lowres.activate()
+            gl.glViewport(0, 0, *size)
+            self.window.clear()
+            self.program["iResolution"] = size
+            self.timer.begin()
+            self.program.draw(gl.GL_TRIANGLE_STRIP)
+            self.timer.end()
+            self.program["iResolution"] = width, height
+            lowres.deactivate()
+            gl.glViewport(0, 0, width, height)
+            blit(lowres, size, (width, height))
+            self.samples = 0
+            return
+        if self.samples < ACCUMULATION_SAMPLES:
+            if not self.accumulation_program:
+                self.accumulation_program = self.tiled_program()
+            program = self.accumulation_program
+            self.set_uniforms(program, frame)
+            program["iResolution"] = width, height
+            offset = sample_offsets(self.samples + 1)[-1]
+            program["iTileOffset"] = offset[0], offset[1]
+            accumulation.activate()
+            if not self.samples:
+                gl.glClearColor(0, 0, 0, 0)
+                gl.glClear(gl.GL_COLOR_BUFFER_BIT)
+            # Running mean of the samples
+            gl.glBlendColor(0, 0, 0, 1 / (self.samples + 1))
+            gl.glBlendFunc(
+                gl.GL_CONSTANT_ALPHA, gl.GL_ONE_MINUS_CONSTANT_ALPHA)
+            program.draw(gl.GL_TRIANGLE_STRIP)
+            gl.glBlendFunc(gl.GL_SRC_ALPHA, gl.GL_ONE_MINUS_SRC_ALPHA)
+            accumulation.deactivate()
+            self.samples += 1
+        blit(accumulation, (width, height), (width, height))
+
+    def render_tiled(self, filename, size, frame, tile_size=TILE_SIZE,
+                     samples=1):
+        """Render the current frame by tiles into a png of any size.
+
+        Each tile accumulates the jittered samples in a float framebuffer,
+        one draw call per sample, and the tile rows are streamed to the png
+        as soon as they are complete.
+        """
+        width, height = size
+        program = self.tiled_program()
+        self.set_uniforms(program, frame)
+        program["iResolution"] = width, height
+        accumulation = np.zeros(
+            (tile_size, tile_size, 4), np.float32).view(gloo.TextureFloat2D)
+        framebuffer = gloo.FrameBuffer(color=[accumulation])
+        framebuffer.activate()
+        # Sum the samples, blended over black like the window rendering
+        gl.glBlendFunc(gl.GL_SRC_ALPHA, gl.GL_ONE)
+        gl.glClearColor(0, 0, 0, 0)
+        offsets = sample_offsets(samples)
+        with open(filename, "wb") as fobj:
+            png = PngWriter(fobj, width, height)
+            # The GL rows are bottom up, the png is written from the top
+            for y in reversed(range(0, height, tile_size)):
+                rows = min(tile_size, height - y)
+                band = np.zeros((rows, width, 3), np.uint8)
+                for x in range(0, width, tile_size):
+                    columns = min(tile_size, width - x)
+                    gl.glViewport(0, 0, columns, rows)
+                    gl.glClear(gl.GL_COLOR_BUFFER_BIT)
+                    for offset in offsets:
+                        program["iTileOffset"] = x + offset[0], y + offset[1]
+                        program.draw(gl.GL_TRIANGLE_STRIP)
+                    pixels = np.zeros((rows, columns, 4), np.float32)
+                    gl.glReadPixels(0, 0, columns, rows,
+                                    gl.GL_RGBA, gl.GL_FLOAT, pixels)
+                    band[:, x:x + columns] = np.rint(np.clip(
+                        pixels[::-1, :, :3] / samples, 0, 1) * 255)
+                png.write(band)
+                print("%s: %d%%" % (filename, 100 * (height - y) / height))
+            png.close()
+        framebuffer.deactivate()
+        program.delete()
+        gl.glBlendFunc(gl.GL_SRC_ALPHA, gl.GL_ONE_MINUS_SRC_ALPHA)
+        gl.glViewport(0, 0, self.window.width, self.window.height)
+        self.window.activate()
 
     def on_resize(self, width, height):
         self.program["iResolution"] = width, height
@@ -358,6 +963,7 @@ void main() {
         #    ",".join(list(map(lambda x: "%.1f" % x, self.front_direction)))))
 
     def on_mouse_drag(self, x, y, dx, dy, button):
+        self.interaction = time.monotonic()
         if self.iMat is not None:
             self.horizontal_angle += dy / 5
             self.vertical_angle += dx / 10
@@ -439,6 +1045,7 @@ void main() {
         ]
 
     def on_mouse_press(self, x, y, button):
+        self.interaction = time.monotonic()
         if self.title == "Map" and button == 4:
             self.updateSeed(x, y)
         if "center" in self.params and button != 4:
@@ -452,6 +1059,7 @@ void main() {
             self.program["iMouse"] = x, self.winsize[1] - y, 0, 0
 
     def on_mouse_scroll(self, x, y, dx, dy):
+        self.interaction = time.monotonic()
         if "range" in self.params:
             if self.title == 'Map':
                 range = 'map_range'
@@ -469,6 +1077,7 @@ void main() {
 
     def on_key_press(self, k, modifiers):
         super().on_key_press(k, modifiers)
+        self.interaction = time.monotonic()
         if self.iMat is not None:
             s = 0.1
             if k == 87:    # z
@@ -530,6 +1139,20 @@ def usage():
     parser.add_argument("--skip", default=0, type=int, metavar="FRAMES_NUMBER")
     parser.add_argument("--size", type=float, default=8,
                         help="render size")
+    parser.add_argument("--resolution", metavar="WIDTHxHEIGHT",
+                        help="render resolution, instead of size")
+    parser.add_argument("--poster", metavar="WIDTHxHEIGHT",
+                        help="render the first frame by tiles and exit")
+    parser.add_argument("--tile-size", type=int, default=TILE_SIZE)
+    parser.add_argument("--samples", type=int, default=1,
+                        help="number of jittered samples per pixel")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="lower the resolution during interactions")
+    parser.add_argument("--frame-time", type=float, metavar="SECONDS",
+                        help="adaptive mode target frame time (1/fps)")
+    parser.add_argument("--headless", action="store_true",
+                        help="render offscreen as fast as possible, with EGL "
+                        "or PYOPENGL_PLATFORM=osmesa")
     parser.add_argument("--export", action="store_true")
     parser.add_argument("--params", help="manual parameters")
     parser.add_argument("fragment", help="fragment file",
@@ -543,17 +1166,28 @@ def usage():
             args.params = json.loads(args.params)
     else:
         args.params = {}
+    args.params = ParamStore(args.params)
 
-    args.winsize = list(map(lambda x: int(x * args.size), [160,  90]))
+    if args.resolution:
+        args.winsize = list(map(int, args.resolution.split('x')))
+    else:
+        args.winsize = list(map(lambda x: int(x * args.size), [160,  90]))
     args.map_size = list(map(lambda x: x//5, args.winsize))
     return args
 
 
 def main(modulator):
     args = usage()
+    if args.headless and not args.record and not args.poster:
+        raise RuntimeError("--headless needs --record or --poster")
     scene = FragmentShader(args)
-    backend = app.__backend__
-    clock = app.__init__(backend=backend, framerate=args.fps)
+    if args.headless:
+        # Frames are stepped as fast as possible, without event loop
+        backend = None
+        args.paused = False
+    else:
+        backend = app.__backend__
+        clock = app.__init__(backend=backend, framerate=args.fps)
     scene.alive = True
     frame = args.skip
     if args.wav:
@@ -577,6 +1211,15 @@ def main(modulator):
         mod(skip, spectre, midi.get(args.midi_skip + skip))
     audio.play = not args.record
 
+    if args.poster:
+        scene.update(frame)
+        scene.render(frame)
+        scene.render_tiled(
+            os.path.join(args.record or ".", "poster-%04d.png" % frame),
+            list(map(int, args.poster.split('x'))), frame,
+            args.tile_size, args.samples)
+        return
+
     scene.alive = True
 
     if args.paused:
@@ -593,33 +1236,37 @@ def main(modulator):
             midi_events = midi.get(args.midi_skip + frame)
             if midi_events:
                 print(midi_events)
-            if mod(frame, spectre, midi.get(args.midi_skip + frame)):
+            if mod(frame, spectre, midi_events):
                 print("Setting alive to false")
                 scene.alive = False
             frame += 1
-            scene.controller.update_sliders()
-        scene.controller.root.update()
         if scene.update(frame):
             scene.render(frame)
 
             if args.record:
-                scene.capture(os.path.join(args.record, "%04d.png" % frame))
+                scene.record(os.path.join(args.record, "%04d.png" % frame))
 
             print("%04d: %.2f sec '%s'" % (
                 frame, time.monotonic() - start_time,
                 json.dumps(scene.controller.get(), sort_keys=True)))
             scene.draw = False
 
-        backend.process(clock.tick())
+        if audio.player and audio.play and not scene.paused:
+            audio.player.sync(AUDIO_SYNC / args.fps)
+        elif audio.player:
+            audio.player.pause()
+        if backend:
+            backend.process(clock.tick())
 
     if args.record:
+        scene.stop_record()
         import subprocess
         cmd = [
             "ffmpeg", "-y", "-framerate", str(args.fps),
-            "-i", "%s/%%04d.png" % args.record,
-            "-i", args.wav,
-            "-c:a", "libvorbis", "-c:v", "copy",
-            "%s/render.mp4" % (args.record)]
+            "-i", "%s/%%04d.png" % args.record]
+        if args.wav:
+            cmd += ["-i", args.wav, "-c:a", "libvorbis"]
+        cmd += ["-c:v", "copy", "%s/render.mp4" % (args.record)]
         print("Running: %s" % " ".join(cmd))
         subprocess.Popen(cmd).wait()
 
@@ -676,17 +1323,22 @@ def run_main(demo, Scene):
                 json.dumps(demo.get(), sort_keys=True)))
 
         if args.record:
-            scene.capture(os.path.join(args.record, "%04d.png" % frame))
+            scene.record(os.path.join(args.record, "%04d.png" % frame))
 
+        if audio.player and audio.play and not demo.paused:
+            audio.player.sync(AUDIO_SYNC / args.fps)
+        elif audio.player:
+            audio.player.pause()
         backend.process(clock.tick())
 
     if args.record:
+        scene.stop_record()
         import subprocess
         cmd = [
             "ffmpeg", "-y", "-framerate", str(args.fps),
-            "-i", "%s/%%04d.png" % args.record,
-            "-i", args.wav,
-            "-c:a", "libvorbis", "-c:v", "copy",
-            "%s/render.mp4" % (args.record)]
+            "-i", "%s/%%04d.png" % args.record]
+        if args.wav:
+            cmd += ["-i", args.wav, "-c:a", "libvorbis"]
+        cmd += ["-c:v", "copy", "%s/render.mp4" % (args.record)]
         print("Running: %s" % " ".join(cmd))
         subprocess.Popen(cmd).wait()
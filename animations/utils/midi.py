@@ -67,6 +67,35 @@ class MidiMod:
         self.prev_val = val
         return val
 
+    def lookup(self, midi, frame):
+        """Same as update(midi.get(frame)) using the track note matrix"""
+        if self.event != "chords":
+            return self.update(midi.get(frame))
+        val = 0
+        for track in midi.midi_tracks:
+            if track.name not in self.track or \
+               not -len(track.active) <= frame < len(track.active) or \
+               not track.active[frame]:
+                continue
+            notes = track.notes[frame]
+            pitches = np.nonzero(notes)[0]
+            if len(pitches):
+                if self.mod == "pitch":
+                    val = pitches[-1] / 127.0
+                    self.decay = (notes[pitches[-1]] - 1) / self.master_decay
+                elif self.mod == "one-off":
+                    val = 1
+                elif self.mod.startswith("ev-"):
+                    for ev_pitch in self.mod.split('-')[1:]:
+                        if notes[int(ev_pitch)]:
+                            val = 1
+            break
+        if self.prev_val > val:
+            decay = (self.prev_val - val) / self.decay
+            val = self.prev_val - decay
+        self.prev_val = val
+        return val
+
 
 class Midi:
     log = logging.getLogger("midi")
@@ -169,8 +198,10 @@ class Midi:
                                        'pos': trk_pos})
                     elif mtype == 0x80:
                         pitch, velocity = read_byte(f), read_byte(f)
-#                        print("NoteOf chan%d %d/%d @ %f" % (
-#                            mchan, pitch, velocity, trk_pos))
+                        events.append({'type': 'noteoff',
+                                       'pitch': pitch,
+                                       'velocity': velocity,
+                                       'pos': trk_pos})
                     elif mtype in (0xB0, 0xC0, 0xD0, 0xE0):
                         if mtype == 0xB0 or mtype == 0xE0:
                             ctr = read_byte(f)
@@ -196,60 +227,122 @@ class Midi:
             pickle.dump(self.tracks, open("%s.pck" % fn, "wb"))
 
     def normalize(self, fps):
-        self.frames = []
-        pos = 1 / fps
+        self.midi_tracks = []
+        events_frame = []
         for track in self.tracks:
             self.log.debug(
                 "Track: %s len %d", track["name"], len(track["events"]))
-        while True:
-            eof = True
-            frame = []
-            for track in self.tracks:
-                trk_events = []
-                trk_pos = track['pos']
-                if trk_pos < len(track['events']):
-                    eof = False
-                else:
-                    continue
-                mod = {}
-                chords = {}
-                while (trk_pos < len(track['events']) and
-                        track['events'][trk_pos]['pos'] < pos):
-                    ev = track['events'][trk_pos]
-                    del ev['pos']
-                    if ev['type'] == 'mod':
-                        if ev['ctr'] not in mod:
-                            mod[ev['ctr']] = []
-                        mod[ev['ctr']].append(ev['val'])
-                    elif ev['type'] == 'note':
-                        chords.setdefault(ev['pitch'], ev['velocity'])
-                    else:
-                        trk_events.append(track['events'][trk_pos])
-                    trk_pos += 1
-                if mod:
-                    for ctr, values in mod.items():
-                        trk_events.append({'type': 'mod',
-                                           'mod': ctr,
-                                           'val': np.sum(values)/len(values)})
-                if chords:
-                    trk_events.append({'type': 'chords', 'pitch': chords})
-                track['pos'] = trk_pos
-                if trk_events:
-                    # Merge ctr
-                    frame.append({'track': track['name'], 'ev': trk_events})
-            self.frames.append(frame)
-            if eof:
-                break
-            pos += 1 / fps
+            events_frame.append(np.zeros(len(track["events"]), np.int32))
+        # Frame end positions, accumulated like the original frame walker
+        count = 1 + max([int(track["events"][-1]["pos"] * fps)
+                         for track in self.tracks if track["events"]] + [0])
+        pos = np.cumsum(np.full(count + 2, 1 / fps))
+        for track, ev_frame in zip(self.tracks, events_frame):
+            ev_frame[:] = np.searchsorted(
+                pos, [ev["pos"] for ev in track["events"]], side='right')
+        self.length = 1 + max([ev_frame[-1] + 1 for ev_frame in events_frame
+                               if len(ev_frame)] + [0])
+        for track, ev_frame in zip(self.tracks, events_frame):
+            self.midi_tracks.append(MidiTrack(
+                track["name"], track["events"], ev_frame, self.length))
 
     def get(self, frame):
-        try:
-            return self.frames[frame]
-        except IndexError:
+        if frame < -self.length or frame >= self.length:
             return []
+        frame %= self.length
+        return [{'track': track.name, 'ev': track.get(frame)}
+                for track in self.midi_tracks if track.active[frame]]
+
+    def matrix(self):
+        """Return the (name, notes, active) tracks used by MidiModBank"""
+        return [(track.name, track.notes, track.active)
+                for track in self.midi_tracks]
+
+
+class MidiTrack:
+    """The per frame state of a midi track.
+
+    notes are the note-on of each frame, 0 for no note and velocity + 1
+    otherwise, held is the velocity of the notes sounding during the frame,
+    cc is the mean value of the control changes of each frame (nan for no
+    change) and active is set when the track has any event on a frame.
+    """
+    def __init__(self, name, events, events_frame, length):
+        self.name = name
+        self.notes = np.zeros((length, 128), np.uint8)
+        self.held = np.zeros((length, 128), np.uint8)
+        self.cc = None
+        self.active = np.zeros(length, bool)
+        # Keep the events in a compact form to rebuild the legacy frames
+        self.ev_frame = []
+        self.ev_type = []
+        self.ev_key = []
+        self.ev_value = []
+        cc_sum = {}
+        state = np.zeros(128, np.uint8)
+        state_frame = 0
+        for ev, frame in zip(events, events_frame):
+            if frame != state_frame:
+                # The notes still held when the frame starts
+                self.held[state_frame + 1:frame + 1] = state
+                state_frame = frame
+            if ev['type'] == 'noteoff' or (
+                    ev['type'] == 'note' and ev['velocity'] == 0):
+                state[ev['pitch']] = 0
+            elif ev['type'] == 'note':
+                state[ev['pitch']] = ev['velocity']
+                self.held[frame, ev['pitch']] = ev['velocity']
+            if ev['type'] == 'noteoff':
+                continue
+            self.active[frame] = True
+            if ev['type'] == 'note':
+                if not self.notes[frame, ev['pitch']]:
+                    self.notes[frame, ev['pitch']] = ev['velocity'] + 1
+                key, value = ev['pitch'], ev['velocity']
+            else:
+                cc = cc_sum.setdefault((frame, ev['ctr']), [0, 0])
+                cc[0] += ev['val']
+                cc[1] += 1
+                key, value = ev['ctr'], ev['val']
+            self.ev_frame.append(frame)
+            self.ev_type.append(ev['type'] == 'note')
+            self.ev_key.append(key)
+            self.ev_value.append(value)
+        self.held[state_frame + 1:] = state
+        if cc_sum:
+            self.cc = np.full((length, 128), np.nan, np.float32)
+            for (frame, ctr), (total, count) in cc_sum.items():
+                self.cc[frame, ctr] = total / count
+        self.ev_offset = np.searchsorted(self.ev_frame, np.arange(length + 1))
+        self.ev_frame = np.array(self.ev_frame, np.int32)
+        self.ev_type = np.array(self.ev_type, bool)
+        self.ev_key = np.array(self.ev_key, np.uint8)
+        self.ev_value = np.array(self.ev_value, np.uint8)
+
+    def get(self, frame):
+        """Return the legacy frame events: mods then chords"""
+        mod = {}
+        chords = {}
+        for idx in range(self.ev_offset[frame], self.ev_offset[frame + 1]):
+            if self.ev_type[idx]:
+                chords.setdefault(int(self.ev_key[idx]),
+                                  int(self.ev_value[idx]))
+            else:
+                mod.setdefault(int(self.ev_key[idx]), []).append(
+                    int(self.ev_value[idx]))
+        trk_events = []
+        for ctr, values in mod.items():
+            trk_events.append({'type': 'mod',
+                               'mod': ctr,
+                               'val': np.sum(values)/len(values)})
+        if chords:
+            trk_events.append({'type': 'chords', 'pitch': chords})
+        return trk_events
 
 
 class NoMidi:
+    midi_tracks = []
+
     def get(self, _):
         return []
 
@@ -0,0 +1,111 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Display-less OpenGL rendering.
+
+The PyOpenGL platform is selected by the PYOPENGL_PLATFORM environment
+variable before OpenGL is imported: 'egl' (the default of gamegl headless
+mode) or 'osmesa' to render on the CPU with Mesa llvmpipe.
+"""
+
+import ctypes
+import os
+
+import numpy as np
+from OpenGL import GL
+from glumpy import gl, gloo
+
+
+def egl_context():
+    from OpenGL import EGL
+    display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+    major, minor = EGL.EGLint(), EGL.EGLint()
+    if not EGL.eglInitialize(
+            display, ctypes.pointer(major), ctypes.pointer(minor)):
+        raise RuntimeError("Couldn't initialize EGL")
+    config = EGL.EGLConfig()
+    count = EGL.EGLint()
+    attributes = [
+        EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+        EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+        EGL.EGL_RED_SIZE, 8, EGL.EGL_GREEN_SIZE, 8, EGL.EGL_BLUE_SIZE, 8,
+        EGL.EGL_DEPTH_SIZE, 24,
+        EGL.EGL_NONE]
+    EGL.eglChooseConfig(
+        display, (EGL.EGLint * len(attributes))(*attributes),
+        ctypes.pointer(config), 1, ctypes.pointer(count))
+    if not count.value:
+        raise RuntimeError("No EGL config for desktop OpenGL")
+    # The scene renders in a framebuffer object, the surface isn't used
+    surface_attributes = [EGL.EGL_WIDTH, 1, EGL.EGL_HEIGHT, 1, EGL.EGL_NONE]
+    surface = EGL.eglCreatePbufferSurface(
+        display, config,
+        (EGL.EGLint * len(surface_attributes))(*surface_attributes))
+    EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+    context = EGL.eglCreateContext(display, config, EGL.EGL_NO_CONTEXT, None)
+    if not context or not EGL.eglMakeCurrent(
+            display, surface, surface, context):
+        raise RuntimeError("Couldn't create the EGL context")
+    return context
+
+
+def osmesa_context():
+    from OpenGL import arrays, osmesa
+    context = osmesa.OSMesaCreateContextExt(osmesa.OSMESA_RGBA, 24, 0, 0, None)
+    if not context:
+        raise RuntimeError("Couldn't create the OSMesa context")
+    buffer = arrays.GLubyteArray.zeros((1, 1, 4))
+    if not osmesa.OSMesaMakeCurrent(
+            context, buffer, GL.GL_UNSIGNED_BYTE, 1, 1):
+        raise RuntimeError("Couldn't activate the OSMesa context")
+    # The buffer needs to outlive the context
+    return context, buffer
+
+
+CONTEXTS = {
+    "egl": egl_context,
+    "osmesa": osmesa_context,
+}
+
+
+class OffscreenWindow:
+    """A stand-in for glumpy app.Window rendering into a framebuffer object
+    of any size"""
+    def __init__(self, width, height):
+        platform = os.environ.get("PYOPENGL_PLATFORM")
+        if platform not in CONTEXTS:
+            raise RuntimeError("%s: PYOPENGL_PLATFORM must be one of %s" % (
+                platform, ", ".join(CONTEXTS)))
+        self.context = CONTEXTS[platform]()
+        self.width, self.height = width, height
+        self.color = np.zeros((height, width, 4), np.uint8).view(
+            gloo.Texture2D)
+        self.framebuffer = gloo.FrameBuffer(
+            color=[self.color], depth=gloo.DepthBuffer(width, height))
+        self.activate()
+        print("Offscreen %dx%d rendering with %s: %s" % (
+            width, height, platform,
+            GL.glGetString(GL.GL_RENDERER).decode('utf-8')))
+
+    def activate(self):
+        self.framebuffer.activate()
+        gl.glViewport(0, 0, self.width, self.height)
+
+    def clear(self, color=(0, 0, 0, 1)):
+        gl.glClearColor(*color)
+        gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
+
+    def attach(self, handler):
+        pass
+
+    def set_title(self, title):
+        pass
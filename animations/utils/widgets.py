@@ -16,23 +16,55 @@ import numpy as np
 from . import hsv
 from . game import Window
 
+# The spectrogram freq values are within [0, 1.875]
+LUT_MAX = 2.
+LUT_SIZE = 2048
+
+
+def hsv_lut(color, size=LUT_SIZE, max_value=LUT_MAX):
+    """Precompute the hsv(*color(point)) of points within [0, max_value]"""
+    return np.array([hsv(*color(point))
+                     for point in np.linspace(0, max_value, size)], dtype='i4')
+
+
+def lut_index(points, size=LUT_SIZE, max_value=LUT_MAX):
+    return np.clip(np.rint(points * ((size - 1) / max_value)),
+                   0, size - 1).astype(int)
+
+
+def blit_ring(surface, columns, head):
+    """Blit a ring of columns, the oldest one being after the head"""
+    split = len(columns) - head - 1
+    height = surface.get_height()
+    if split:
+        pygame.surfarray.blit_array(
+            surface.subsurface((0, 0, split, height)), columns[head + 1:])
+    pygame.surfarray.blit_array(
+        surface.subsurface((split, 0, head + 1, height)), columns[:head + 1])
+
+
+def bars(values, height, color=0xfafafa):
+    """Return the pixels of vertical bars of values ratio of height"""
+    top = (height - values * height).astype(int)
+    return np.where(np.arange(height) >= top[:, np.newaxis], color, 0)
+
 
 class Waterfall(Window):
     def __init__(self, window_size, zoom=1):
         Window.__init__(self, window_size)
         self.zoom = zoom
-        self.pixels = np.zeros(self.length, dtype='i4').reshape(*window_size)
+        self.columns = np.zeros(window_size, dtype='i4')
+        self.head = window_size[0] - 1
+        self.lut = hsv_lut(lambda point: (
+            0.5 + 0.4 * point, 0.3 + 0.6 * point, 0.2 + 0.7 * point))
+        # The freq index of each row, from the bottom
+        self.rows = np.arange(window_size[1] - 1, -1, -1) // zoom
 
     def render(self, spectrogram):
-        self.pixels = np.roll(self.pixels, -1, axis=0)
-        for y in range(0, self.window_size[1], self.zoom):
-            inv_y = self.window_size[1] - y - 1
-            point = spectrogram.freq[y // self.zoom]
-            for suby in range(self.zoom):
-                self.pixels[-1][inv_y - suby] = hsv(
-                    0.5 + 0.4 * point,
-                    0.3 + 0.6 * point,
-                    0.2 + 0.7 * point)
+        self.head = (self.head + 1) % self.window_size[0]
+        self.columns[self.head] = self.lut[lut_index(
+            spectrogram.freq[self.rows])]
+        blit_ring(self.surface, self.columns, self.head)
 
 
 class SpectroGraph(Window):
@@ -43,21 +75,17 @@ class SpectroGraph(Window):
         self.zoom = zoom
         self.decay = decay
         self.graph_length = min(window_size[0] - self.zoom, frame_size // 2)
+        self.bands = -(-self.graph_length // self.zoom)
+        self.graph = np.zeros(window_size, dtype='i4')
 
     def render(self, spectrogram):
-        self.fill(0x00000)
-        for x in range(0, self.graph_length, self.zoom):
-            freq_pos = x // self.zoom
-            val = spectrogram.band[freq_pos]
-            if self.values[freq_pos] > val:
-                decay = (self.values[freq_pos] - val) / self.decay
-                val = self.values[freq_pos] - decay
-            self.values[freq_pos] = val
-            for subx in range(self.zoom):
-                self.draw_line(
-                    (x + subx, self.height),
-                    (x + subx, self.height - val * self.height),
-                    0xfafafa)
+        values = self.values[:self.bands]
+        val = spectrogram.band[:self.bands]
+        decayed = values - (values - val) / self.decay
+        values[:] = np.where(values > val, decayed, val)
+        self.graph[:self.bands * self.zoom] = bars(
+            np.repeat(values, self.zoom), self.height)
+        self.blit(self.graph)
 
 
 class ModColor(Window):
@@ -65,12 +93,14 @@ class ModColor(Window):
         super().__init__(window_size)
         self.base_hue = base_hue
         self.values = np.zeros(self.window_size[0]) + self.window_size[1]
+        self.head = self.window_size[0] - 1
+        self.xs = np.arange(self.window_size[0])
 
     def render(self, val):
-        self.values = np.roll(self.values, -1)
-        self.values[-1] = self.window_size[1] - self.window_size[1] * val
+        self.head = (self.head + 1) % self.window_size[0]
+        height = self.window_size[1]
+        self.values[self.head] = height - height * val
         self.surface.fill(hsv(self.base_hue + 0.3 * val, 0.8, 0.5 + 2 * val))
-        for x in range(0, self.window_size[0] - 1):
-            pygame.draw.line(self.surface, 0xfafafa,
-                             (x, self.values[x]),
-                             (x + 1, self.values[x+1]))
+        values = np.roll(self.values, -1 - self.head)
+        pygame.draw.lines(self.surface, 0xfafafa, False,
+                          np.stack((self.xs, values), axis=-1).tolist())
@@ -11,6 +11,7 @@
 # under the License.
 
 import argparse
+import atexit
 import cmath
 import math
 import colorsys
@@ -18,8 +19,11 @@ import os
 import sys
 import signal
 import multiprocessing
+from multiprocessing import resource_tracker, shared_memory
 import numpy as np
 
+from utils import hsv_array, pack_rgb
+
 
 # Raw color
 def rgb(r, g, b):
@@ -39,11 +43,21 @@ def grayscale(r):
     return int(r * 0xff) | int((r * 0xff)) << 8 | int(r * 0xff) << 16
 
 
+def hsv_colors(h, s, v):
+    """hsv for arrays"""
+    return pack_rgb(hsv_array(h, s, v))
+
+
 def dark_color_factory(scale, dummy):
     def dark_color(x):
         if x == scale:
             return 0
         return hsv(0.6 + 0.4 * x / (2 * scale), 0.7, 0.5)
+
+    def dark_color_array(x):
+        return np.where(x == scale, 0,
+                        hsv_colors(0.6 + 0.4 * x / (2 * scale), 0.7, 0.5))
+    dark_color.array = dark_color_array
     return dark_color
 
 
@@ -52,6 +66,11 @@ def bright_color_factory(scale, base_hue=0.4):
         if x == scale:
             return 0
         return hsv(base_hue + x / scale, 0.7, 0.7)
+
+    def bright_color_array(x):
+        return np.where(x == scale, 0,
+                        hsv_colors(base_hue + x / scale, 0.7, 0.7))
+    bright_color.array = bright_color_array
     return bright_color
 
 
@@ -60,17 +79,30 @@ def grayscale_color_factory(scale):
         if x == scale:
             return 0
         return grayscale(x / scale)
+
+    def grayscale_color_array(x):
+        r = x / scale
+        return np.where(x == scale, 0, pack_rgb(np.stack([r, r, r], -1)))
+    grayscale_color.array = grayscale_color_array
     return grayscale_color
 
 
 def log_sin_lightblue(scale, base=1):
-    def color_func(x, y, z):
+    def color_func(x, *_):
         if x == 0: # or x == scale:
             return 0
         rlog = abs(math.sin(math.log(math.pow(x + 50, 7))))
         glog = abs(math.sin(math.log(math.pow(x + 50, 7))))
         blog = abs(math.sin(math.log(math.pow(x + 150, 7))))
         return rgb250(10 + 150 * rlog, 40 + 150 * glog, 100 + 150 * blog * base)
+
+    def color_array(x):
+        rlog = np.abs(np.sin(np.log(np.power(x + 50., 7))))
+        blog = np.abs(np.sin(np.log(np.power(x + 150., 7))))
+        return np.where(x == 0, 0, pack_rgb(np.stack([
+            10 + 150 * rlog, 40 + 150 * rlog, 100 + 150 * blog * base], -1),
+            1))
+    color_func.array = color_array
     return color_func
 
 
@@ -83,25 +115,33 @@ def log_sin_lightpurple(scale):
         glog = abs(math.sin(math.log(math.pow(x + 50, 2))))
         blog = abs(math.sin(math.log(math.pow(x + 150, 4))))
         return rgb250(100 + 100 * rlog, 40 + 120 * glog, 60 + 150 * blog)
+
+    def color_array(x):
+        rlog = np.abs(np.sin(np.log(np.power(x + 50., 2))))
+        blog = np.abs(np.sin(np.log(np.power(x + 150., 4))))
+        return np.where((x == 0) | (x == scale), 0, pack_rgb(np.stack([
+            100 + 100 * rlog, 40 + 120 * rlog, 60 + 150 * blog], -1), 1))
+    color_func.array = color_array
     return color_func
 
 
 def gradient(scale):
-    color_map = np.zeros(scale, dtype='uint32')
-
     def gaussian(x, a, b, c, d=0):
-        return a * math.exp(-(x - b)**2 / (2 * c**2)) + d
-    for x in range(scale):
-        r = int(gaussian(x, 158.8242, 201, 87.0739) +
-                gaussian(x, 158.8242, 402, 87.0739))
-        g = int(gaussian(x, 129.9851, 157.7571, 108.0298) +
-                gaussian(x, 200.6831, 399.4535, 143.6828))
-        b = int(gaussian(x, 231.3135, 206.4774, 201.5447) +
-                gaussian(x, 17.1017, 395.8819, 39.3148))
-        color_map[x] = rgb250(r, g, b)
+        return a * np.exp(-(x - b)**2 / (2 * c**2)) + d
+    x = np.arange(scale)
+    r = gaussian(x, 158.8242, 201, 87.0739) + \
+        gaussian(x, 158.8242, 402, 87.0739)
+    g = gaussian(x, 129.9851, 157.7571, 108.0298) + \
+        gaussian(x, 200.6831, 399.4535, 143.6828)
+    b = gaussian(x, 231.3135, 206.4774, 201.5447) + \
+        gaussian(x, 17.1017, 395.8819, 39.3148)
+    # The scale value is inside the set, like the other color maps
+    color_map = np.zeros(scale + 1, dtype='uint32')
+    color_map[:scale] = pack_rgb(np.stack([r, g, b], -1), 1)
 
     def color_func(x):
         return color_map[x]
+    color_func.array = lambda x: np.take(color_map, x)
     return color_func
 
 
@@ -112,17 +152,27 @@ def gradient2(scale):
         return hsv(0.6 + (x / scale) * 0.2,
                    (1 - (x / scale) * 0.5),
                    (1 - (x / scale) * 0.5))
+
+    def color_array(x):
+        return np.where(
+            (x == scale - 1) | (x == scale - 2) | (x == 0), 0,
+            hsv_colors(0.6 + (x / scale) * 0.2,
+                       (1 - (x / scale) * 0.5),
+                       (1 - (x / scale) * 0.5)))
+    color_func.array = color_array
     return color_func
 
 
 ColorMap = {
     'gradient': gradient,
+    'gradient2': gradient2,
     'bright': bright_color_factory,
     'grayscale': grayscale_color_factory,
     'log+sin+lightblue': log_sin_lightblue,
     'log+sin+lightpurple': log_sin_lightpurple,
 }
 
+
 # Basic maths
 MAX_SHORT = float((2 ** (2 * 8)) // 2)
 PHI = (1+math.sqrt(5))/2.0
@@ -182,8 +232,9 @@ def usage_cli_complex(argv=sys.argv[1:], center=0j, radius=3., c=0, seed='',
     args.center = np.complex128(args.center)
     args.radius = np.float64(args.radius)
     if not args.opencl and args.worker >= 2:
-        if args.length / args.worker != args.length // args.worker:
-            raise RuntimeError("Worker isn't a multiple of %d" % args.length)
+        # Share the resource tracker with the workers, otherwise they unlink
+        # the shared frame when they exit
+        resource_tracker.ensure_running()
         args.pool = multiprocessing.Pool(args.worker, lambda: signal.signal(
             signal.SIGINT, signal.SIG_IGN))
     else:
@@ -207,6 +258,52 @@ def run_main(main):
         pid.terminate()
 
 
+# Small tiles keep all the workers busy, rows near the set cost far more
+# than others
+TILES_PER_WORKER = 16
+# The shared frame attached by a pool worker
+worker_frame = {}
+
+
+def compute_tile(param):
+    """Compute a tile in a pool worker and write it to the shared frame"""
+    method, frame_name, dtype, length, params = param
+    if worker_frame.get("name") != frame_name:
+        if worker_frame:
+            del worker_frame["array"]
+            worker_frame["shm"].close()
+        shm = shared_memory.SharedMemory(name=frame_name)
+        worker_frame.update(name=frame_name, shm=shm, array=np.ndarray(
+            length, dtype=dtype, buffer=shm.buf))
+    step_size, chunk = params[-2:]
+    start = chunk * step_size
+    end = min(start + step_size, length)
+    worker_frame["array"][start:end] = method(params)[:end - start]
+
+
+class SharedFrame:
+    """A frame buffer written by the pool workers"""
+    def __init__(self, length, dtype):
+        self.length = length
+        self.dtype = np.dtype(dtype)
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=max(1, length * self.dtype.itemsize))
+        self.array = np.ndarray(length, dtype=self.dtype, buffer=self.shm.buf)
+        atexit.register(self.close)
+
+    def close(self):
+        if self.shm is None:
+            return
+        del self.array
+        try:
+            self.shm.close()
+        except BufferError:
+            # A returned frame is still referenced
+            pass
+        self.shm.unlink()
+        self.shm = None
+
+
 class ComplexPlane:
     def set_view(self, center=None, radius=None):
         if center is not None:
@@ -226,20 +323,30 @@ class ComplexPlane:
             self.window_size[1] / float(self.plane_max[1] - self.plane_min[1])
         )
 
-    def compute_chunks(self, method, params):
+    def compute_chunks(self, method, params, dtype='i4'):
         params = [self.window_size, self.offset, self.scale,
-                  self.args.sampling] + params + [self.length]
+                  self.args.sampling] + params
         if self.args.worker >= 2:
-            # Divide image length by number of worker
-            params[-1] //= self.args.worker
-            # Append chunk position
-            params = list(map(lambda x: params + [x], range(self.args.worker)))
-            # Compute
-            res = self.args.pool.map(method, params)
-            # Return flatten array
-            return np.array(res).flatten()
-        # Mono process just compute first chunk
-        return method(params + [0])
+            frame = getattr(self, "shared_frame", None)
+            if frame is None or frame.length != self.length or \
+               frame.dtype != dtype:
+                if frame is not None:
+                    frame.close()
+                frame = self.shared_frame = SharedFrame(self.length, dtype)
+            # Keep the sampled pixels aligned on the tiles
+            sampling = params[3]
+            tile_size = sampling * math.ceil(
+                self.length / (self.args.worker * TILES_PER_WORKER * sampling))
+            tiles = [(method, frame.shm.name, frame.dtype, self.length,
+                      params + [tile_size, chunk])
+                     for chunk in range(math.ceil(self.length / tile_size))]
+            # Tiles are pulled by the workers as they become available, the
+            # returned frame is overwritten by the next call
+            for _ in self.args.pool.imap_unordered(compute_tile, tiles):
+                pass
+            return frame.array
+        # Mono process just compute the whole image
+        return method(params + [self.length, 0])
 
     def convert_to_plane(self, screen_coord):
         return complex(
@@ -34,12 +34,9 @@ def compute_julia_opencl(q, max_iter, c, norm, color_mod):
         prg_src = []
         num_color = 4096
         if color_mod == "gradient":
-            colors = gradient(num_color)
-            colors_array = []
-            for idx in range(num_color):
-                colors_array.append(str(colors(idx)))
+            colors = gradient(num_color).array(np.arange(num_color))
             prg_src.append("__constant uint gradient[] = {%s};" %
-                           ",".join(colors_array))
+                           ",".join(map(str, colors)))
         prg_src.append("""
         #pragma OPENCL EXTENSION cl_khr_byte_addressable_store : enable
         #pragma OPENCL EXTENSION cl_khr_fp64 : enable
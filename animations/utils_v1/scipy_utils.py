@@ -31,7 +31,8 @@ class NoAudio:
 
 class Audio:
     def __init__(self, wav_file, fps=25, play=True):
-        freq, wav = scipy.io.wavfile.read(wav_file)
+        # Memory map the pcm data instead of loading the whole file
+        freq, wav = scipy.io.wavfile.read(wav_file, mmap=True)
         if freq % fps != 0:
             raise RuntimeError("Can't load wav %d Hz at %d fps" % (freq, fps))
         self.audio_frame_size = freq // fps
@@ -169,16 +170,12 @@ class AudioMod:
             print("Only support mono 16bit encoding...")
             exit(1)
 
-        # Read all frames
-        buf = wav.readframes(wav.getnframes())
-
-        # Convert to float array [-1; 1]
-        w = np.fromstring(buf, np.int16) / float((2 ** (2 * 8)) / 2)
-
         step = wav.getnframes() // self.frames + 1
         wave_values = []
         for i in range(0, wav.getnframes(), step):
-            wf = w[i:i+step]
+            # Convert the next step of frames to float array [-1; 1]
+            wf = np.frombuffer(wav.readframes(step), np.int16) / float(
+                (2 ** (2 * 8)) / 2)
             if self.fp:
                 wf = self.fp.filter(wf)
 
@@ -16,10 +16,12 @@ Flower seeds distribution representation based on this video
 https://www.youtube.com/watch?v=sj8Sg8qnjOg
 """
 
-import colorsys
 import math
 
+import numpy as np
+
 from utils import animation
+from utils import hsv_array
 from utils import game
 from utils import audio
 
@@ -45,25 +47,23 @@ class FlowerSeeds(game.Window):
         game.Window.__init__(self, winsize)
         self.params = params
 
-    def seed(self, angle, distance):
-        # Return coordinate of a point on a mod circle
-        return (int(self.window_size[0] / 2 + distance * math.sin(angle)),
-                int(self.window_size[1] / 2 + distance * math.cos(angle)))
+    def seeds(self, angle, distance):
+        # Return coordinates of the seeds
+        return np.stack((
+            self.window_size[0] / 2 + distance * np.sin(angle),
+            self.window_size[1] / 2 + distance * np.cos(angle)), axis=-1
+        ).astype(int)
 
     def render(self, frame):
         self.fill()
         seeds, ratio = self.params["seeds"], self.params["ratio"]
         size, base_hue = self.params["size"], self.params["hue"]
-        angle = 0
-        distance = 5
-        for j in range(0, seeds):
-            coord = self.seed(angle, distance)
-            angle += math.pi * ratio * 2
-            distance += self.params["distance"]
-            hue = base_hue + (j % 100) / 300.0
-            color = list(map(lambda x: x * 255, colorsys.hsv_to_rgb(
-                hue + 0.001 * j, 0.7, 0.7)))
-            self.draw_circle(coord, size, color)
+        j = np.arange(seeds)
+        coords = self.seeds(j * math.pi * ratio * 2,
+                            5 + j * self.params["distance"])
+        hue = base_hue + (j % 100) / 300.0
+        colors = hsv_array(hue + 0.001 * j, 0.7, 0.7) * 255
+        self.draw_circles(coords, size, colors)
         self.draw_msg("Ratio: %.8f" % self.params["ratio"])
         return True
 
@@ -17,18 +17,25 @@ change the rate based on a binary seed, see
 https://en.wikipedia.org/wiki/Lyapunov_fractal.
 """
 
+import atexit
 import colorsys
 import sys
 import time
 import math
 import numpy as np
 import multiprocessing
+from multiprocessing import resource_tracker, shared_memory
 import pygame
 import pygame.locals
 import signal
 from pygame.locals import KEYDOWN, MOUSEBUTTONDOWN
 from pygame.locals import K_ESCAPE, K_UP, K_DOWN, K_LEFT, K_RIGHT
 from pygame.locals import K_a, K_e, K_p, K_r
+try:
+    import pyopencl as cl
+except ImportError:
+    print("Install pyopencl for gpu rendering")
+    cl = None
 
 
 SEED = "AB"
@@ -36,6 +43,96 @@ WINSIZE = [100, 100]
 CENTER = 2+2j
 RADIUS = 2
 WORKERS = 8
+# "opencl" renders on the gpu, "numpy" evaluates a whole tile at once and
+# "python" iterates pixel by pixel
+ENGINE = "opencl" if cl else "numpy"
+if ENGINE == "opencl":
+    WINSIZE = [1280, 720]
+# Number of exponent colors, lower exponents use the last one
+GRADIENT_LENGTH = 4096
+
+
+###############################################################################
+# OpenCL kernel code
+###############################################################################
+CLKERNEL = """__constant uint gradient[] = {{{gradient_values}}};
+#pragma OPENCL EXTENSION cl_khr_fp64 : enable
+__kernel void lyapunov(
+    __global uchar *seed,
+    __global uint *pixels,
+    uint const seed_length,
+    double const x0,
+    uint const max_init,
+    uint const max_iter,
+    uint const height,
+    double const offset_real,
+    double const offset_imag,
+    double const scale_real,
+    double const scale_imag
+) {{
+    int gid = get_global_id(0);
+    double rate_a = ((double)gid / height) / scale_real + offset_real;
+    double rate_b = (height - (gid % height)) / scale_imag + offset_imag;
+    double x = x0;
+    double r, new_x, v;
+    double total = 0.0;
+    uint idx;
+    // Init
+    for (idx = 0; idx < max_init; idx++) {{
+        r = seed[idx % seed_length] == 'A' ? rate_a : rate_b;
+        new_x = r * x * (1 - x);
+        if (!isfinite(new_x)) {{
+            break;
+        }}
+        x = new_x;
+    }}
+    // Exponent
+    for (idx = 0; idx < max_iter; idx++) {{
+        r = seed[idx % seed_length] == 'A' ? rate_a : rate_b;
+        new_x = r * x * (1 - x);
+        if (!isfinite(new_x)) {{
+            break;
+        }}
+        x = new_x;
+        v = fabs(r - 2 * r * x);
+        if (v == 0) {{
+            break;
+        }}
+        total += log(v) / log(1.23);
+    }}
+    int exponent = 0;
+    if (total != 0 && isfinite(total)) {{
+        exponent = (int)(total / (double)max_iter);
+    }}
+    pixels[gid] = gradient[clamp(-exponent, 0, {gradient_length} - 1)];
+}}"""
+
+
+class OpenCLCompute:
+    def __init__(self, program):
+        self.ctx = cl.create_some_context()
+        self.queue = cl.CommandQueue(self.ctx)
+        self.kernel = cl.Program(self.ctx, program).build()
+        self.pixels = None
+
+    def render(self, length, seed, *args):
+        mf = cl.mem_flags
+        # Seed is the byte string of the rate sequence
+        seed = np.frombuffer(seed.encode('ascii'), dtype=np.uint8)
+        seed_opencl = cl.Buffer(
+            self.ctx, mf.READ_ONLY | mf.COPY_HOST_PTR, hostbuf=seed)
+        # Pixels is the output array, kept between frames
+        if self.pixels is None or len(self.pixels) != length:
+            self.pixels = np.empty(length, dtype=np.uint32)
+            self.pixels_opencl = cl.Buffer(
+                self.ctx, mf.WRITE_ONLY, self.pixels.nbytes)
+        # Call kernel
+        self.kernel.lyapunov(
+            self.queue, self.pixels.shape, None, seed_opencl,
+            self.pixels_opencl, np.uint32(len(seed)), *args)
+        # Read pixel buffer
+        cl.enqueue_copy(self.queue, self.pixels, self.pixels_opencl).wait()
+        return self.pixels
 
 
 ###############################################################################
@@ -91,6 +188,108 @@ def compute_markus_lyapunov(param):
     return results
 
 
+def compute_markus_lyapunov_numpy(param):
+    """Vectorized compute_markus_lyapunov, all the tile pixels are iterated
+    together and the overflowing pixels are masked out"""
+    window_size, offset, scale, sampling, seed, x0, max_iter, max_init, \
+        step_size, chunk = param
+
+    results = np.zeros(step_size, dtype='i4')
+    pos = np.arange(0, step_size, sampling)
+    step_pos = pos + chunk * step_size
+    rates = (
+        # The "B" rate
+        (window_size[1] - step_pos % window_size[1]) / scale[1] + offset[1],
+        # The "A" rate
+        (step_pos / window_size[1]) / scale[0] + offset[0],
+    )
+    pattern = [rates[seed[idx % len(seed)] == "A"]
+               for idx in range(len(seed))]
+
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        # Init
+        x = np.full(len(pos), x0, dtype=np.float128)
+        active = np.ones(len(pos), dtype=bool)
+        for idx in range(0, max_init):
+            r = pattern[idx % len(pattern)]
+            new_x = r * x * (1 - x)
+            active &= np.isfinite(new_x)
+            x = np.where(active, new_x, x)
+
+        # Exponent
+        total = np.zeros(len(pos), dtype=np.float64)
+        active[:] = True
+        log_base = math.log(1.23)
+        for idx in range(0, max_iter):
+            r = pattern[idx % len(pattern)]
+            new_x = r * x * (1 - x)
+            active &= np.isfinite(new_x)
+            x = np.where(active, new_x, x)
+            v = np.abs(r - 2 * r * x)
+            active &= v != 0
+            total = np.where(
+                active, total + np.log(v.astype(np.float64)) / log_base, total)
+            if not active.any():
+                break
+
+        exponent = total / float(max_iter)
+        exponent[(total == 0) | ~np.isfinite(total)] = 0
+    results[pos] = exponent
+    return results
+
+
+ENGINES = {
+    "numpy": compute_markus_lyapunov_numpy,
+    "python": compute_markus_lyapunov,
+}
+
+
+# Small tiles keep all the workers busy, rows near the set cost far more
+# than others
+TILES_PER_WORKER = 16
+# The shared frame attached by a pool worker
+worker_frame = {}
+
+
+def compute_tile(param):
+    """Compute a tile in a pool worker and write it to the shared frame"""
+    method, frame_name, dtype, length, params = param
+    if worker_frame.get("name") != frame_name:
+        if worker_frame:
+            del worker_frame["array"]
+            worker_frame["shm"].close()
+        shm = shared_memory.SharedMemory(name=frame_name)
+        worker_frame.update(name=frame_name, shm=shm, array=np.ndarray(
+            length, dtype=dtype, buffer=shm.buf))
+    step_size, chunk = params[-2:]
+    start = chunk * step_size
+    end = min(start + step_size, length)
+    worker_frame["array"][start:end] = method(params)[:end - start]
+
+
+class SharedFrame:
+    """A frame buffer written by the pool workers"""
+    def __init__(self, length, dtype):
+        self.length = length
+        self.dtype = np.dtype(dtype)
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=max(1, length * self.dtype.itemsize))
+        self.array = np.ndarray(length, dtype=self.dtype, buffer=self.shm.buf)
+        atexit.register(self.close)
+
+    def close(self):
+        if self.shm is None:
+            return
+        del self.array
+        try:
+            self.shm.close()
+        except BufferError:
+            # A returned frame is still referenced
+            pass
+        self.shm.unlink()
+        self.shm = None
+
+
 ###############################################################################
 # Pygame abstraction
 ###############################################################################
@@ -112,6 +311,37 @@ def color_factory(size, base_hue=0.65):
     return color_scale
 
 
+class ColorLUT:
+    """Apply a color function to an array of integer values.
+
+    The function is evaluated once per value into a lookup table, which is
+    extended when new values show up, and the array is colored with a single
+    np.take.
+    """
+    def __init__(self, color_func, start=0, end=0):
+        self.color_func = color_func
+        self.start = start
+        self.table = np.array([color_func(x) for x in range(start, end)])
+
+    def extend(self, start, end):
+        start = min(start, self.start)
+        end = max(end, self.start + len(self.table))
+        before = [self.color_func(x) for x in range(start, self.start)]
+        after = [self.color_func(x) for x in range(
+            self.start + len(self.table), end)]
+        self.table = np.array(before + list(self.table) + after)
+        self.start = start
+
+    def __call__(self, values):
+        values = np.asarray(values)
+        if not values.size:
+            return np.zeros(values.shape, dtype=self.table.dtype)
+        low, high = int(values.min()), int(values.max())
+        if low < self.start or high >= self.start + len(self.table):
+            self.extend(low, high + 1)
+        return np.take(self.table, values - self.start)
+
+
 class Screen:
     def __init__(self, screen_size):
         pygame.init()
@@ -145,9 +375,12 @@ class ComplexPlane:
             if radius == 0:
                 raise RuntimeError("Radius can't be null")
             self.radius = radius
-        self.plane_min = (self.center.real - self.radius,
+        # The radius is for the height, widen the real axis to keep the
+        # pixels square on a wide window
+        real_radius = self.radius * self.window_size[0] / self.window_size[1]
+        self.plane_min = (self.center.real - real_radius,
                           self.center.imag - self.radius)
-        self.plane_max = (self.center.real + self.radius,
+        self.plane_max = (self.center.real + real_radius,
                           self.center.imag + self.radius)
         # Coordinate conversion vector
         self.offset = (self.plane_min[0], self.plane_min[1])
@@ -156,20 +389,30 @@ class ComplexPlane:
             self.window_size[1] / float(self.plane_max[1] - self.plane_min[1])
         )
 
-    def compute_chunks(self, method, params):
+    def compute_chunks(self, method, params, dtype='i4'):
         params = [self.window_size, self.offset, self.scale,
-                  1] + params + [self.length]
+                  1] + params
         if WORKERS >= 2:
-            # Divide image length by number of worker
-            params[-1] //= WORKERS
-            # Append chunk position
-            params = list(map(lambda x: params + [x], range(WORKERS)))
-            # Compute
-            res = self.pool.map(method, params)
-            # Return flatten array
-            return np.array(res).flatten()
-        # Mono process just compute first chunk
-        return method(params + [0])
+            frame = getattr(self, "shared_frame", None)
+            if frame is None or frame.length != self.length or \
+               frame.dtype != dtype:
+                if frame is not None:
+                    frame.close()
+                frame = self.shared_frame = SharedFrame(self.length, dtype)
+            # Keep the sampled pixels aligned on the tiles
+            sampling = params[3]
+            tile_size = sampling * math.ceil(
+                self.length / (WORKERS * TILES_PER_WORKER * sampling))
+            tiles = [(method, frame.shm.name, frame.dtype, self.length,
+                      params + [tile_size, chunk])
+                     for chunk in range(math.ceil(self.length / tile_size))]
+            # Tiles are pulled by the workers as they become available, the
+            # returned frame is overwritten by the next call
+            for _ in self.pool.imap_unordered(compute_tile, tiles):
+                pass
+            return frame.array
+        # Mono process just compute the whole image
+        return method(params + [self.length, 0])
 
     def convert_to_plane(self, screen_coord):
         return complex(
@@ -231,22 +474,42 @@ class Window:
 class MarkusLyapunov(Window, ComplexPlane):
     def __init__(self):
         Window.__init__(self, WINSIZE)
-        self.pool = multiprocessing.Pool(
-            WORKERS, lambda: signal.signal(signal.SIGINT, signal.SIG_IGN))
         self.seed = SEED
         self.x0 = 0.5
         self.max_iter = 100
         self.max_init = 50
         self.set_view(CENTER, RADIUS)
-        self.color_vector = np.vectorize(color_factory(22.))
+        if ENGINE == "opencl":
+            # The exponents are mapped to the colors on the device
+            color_scale = color_factory(22.)
+            self.gpu = OpenCLCompute(CLKERNEL.format(
+                gradient_values=",".join([
+                    str(color_scale(-idx)) for idx in range(GRADIENT_LENGTH)
+                ]),
+                gradient_length=GRADIENT_LENGTH))
+            return
+        self.color_vector = ColorLUT(color_factory(22.))
+        if WORKERS >= 2:
+            # Share the resource tracker with the workers, otherwise they
+            # unlink the shared frame when they exit
+            resource_tracker.ensure_running()
+            self.pool = multiprocessing.Pool(
+                WORKERS, lambda: signal.signal(signal.SIGINT, signal.SIG_IGN))
 
     def render(self, frame):
         start_time = time.time()
 
-        nparray = self.compute_chunks(compute_markus_lyapunov, [
-            self.seed, self.x0, self.max_iter, self.max_init])
-
-        self.blit(self.color_vector(nparray))
+        if ENGINE == "opencl":
+            self.blit(self.gpu.render(
+                self.length, self.seed, np.float64(self.x0),
+                np.uint32(self.max_init), np.uint32(self.max_iter),
+                np.uint32(self.window_size[1]),
+                np.float64(self.offset[0]), np.float64(self.offset[1]),
+                np.float64(self.scale[0]), np.float64(self.scale[1])))
+        else:
+            nparray = self.compute_chunks(ENGINES[ENGINE], [
+                self.seed, self.x0, self.max_iter, self.max_init])
+            self.blit(self.color_vector(nparray))
         print("%04d: %.2f sec: ./markus_lyapunov.py --seed '%s' --center '%s' "
               "--radius '%s'" % (frame, time.time() - start_time, self.seed,
                                  self.center, self.radius))
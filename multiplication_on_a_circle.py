@@ -16,9 +16,9 @@ Multiplication table on a circle as explained in
 https://www.youtube.com/watch?v=-X49VQgi86E
 """
 
-import colorsys
 import math
 
+import numpy as np
 import pygame
 from pygame.locals import KEYUP, K_ESCAPE, K_UP, K_DOWN, K_LEFT, K_RIGHT, K_p
 import pygame.draw
@@ -30,10 +30,27 @@ RADIUS = WINSIZE[0] / 2 - 2
 
 
 def circle_point(mod, point, radius=RADIUS):
-    # Return coordinate of a point on a mod circle
-    angle = ((point % mod) * 360 / float(mod)) * math.pi / 180.0
-    return (int(CENTER[0] + radius * math.sin(angle)),
-            int(CENTER[1] + radius * math.cos(angle)))
+    # Return coordinates of points on a mod circle
+    angle = np.asarray(point) % mod * 360 / float(mod) * math.pi / 180.0
+    return np.stack((CENTER[0] + radius * np.sin(angle),
+                     CENTER[1] + radius * np.cos(angle)), axis=-1).astype(int)
+
+
+def hsv_array(h, s, v):
+    """colorsys.hsv_to_rgb for arrays, return a (n, 3) array of rgb"""
+    h, s, v = np.broadcast_arrays(*map(np.asarray, (h, s, v)))
+    i = np.trunc(h * 6.0)
+    f = (h * 6.0) - i
+    p = v * (1.0 - s)
+    q = v * (1.0 - s * f)
+    t = v * (1.0 - s * (1.0 - f))
+    i = i.astype(int) % 6
+    channels = np.stack([
+        (v, t, p), (q, v, p), (p, v, t), (p, q, v), (t, p, v), (v, p, q)])
+    rgb = np.moveaxis(np.take_along_axis(channels, i[np.newaxis, np.newaxis],
+                                         axis=0)[0], 0, -1)
+    rgb[s == 0] = v[s == 0][..., np.newaxis]
+    return rgb
 
 
 def draw_msg(msg, coord=(5, 780), color=(180, 180, 255)):
@@ -46,13 +63,14 @@ class CircleRender:
         self.mod, self.mult, self.step, self.hue = mod, start_mult, step, hue
 
     def draw(self, frame):
-        for j in range(1, self.mod):
-            # Draw a line between two mult points
-            s = circle_point(self.mod, j)
-            d = circle_point(self.mod, j * self.mult)
-            hue = self.hue + (j % 100) / 300.0
-            color = list(map(lambda x: x * 255, colorsys.hsv_to_rgb(
-                hue, 0.5, 0.2 + j / (float(self.mod)*1.5))))
+        # Compute all the lines between two mult points at once
+        j = np.arange(1, self.mod)
+        starts = circle_point(self.mod, j).tolist()
+        ends = circle_point(self.mod, j * self.mult).tolist()
+        hue = self.hue + (j % 100) / 300.0
+        colors = (hsv_array(
+            hue, 0.5, 0.2 + j / (float(self.mod)*1.5)) * 255).astype(int)
+        for s, d, color in zip(starts, ends, colors.tolist()):
             pygame.draw.line(screen, color, s, d, 1)
         self.mult += self.step
 
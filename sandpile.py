@@ -14,15 +14,31 @@
 """Sandpile fractal"""
 
 import colorsys
+import multiprocessing
 import numpy as np
 import scipy.signal
 import pygame
 import pygame.locals
 import time
+from multiprocessing import shared_memory
+try:
+    from numba import njit
+except ImportError:
+    print("Install numba for faster stabilization")
+    njit = None
 
 ZOOM = 4
 WINSIZE = [500, 500]
 INIT = 1000
+# "step" topples one grain quartet per unstable cell for INIT steps,
+# "stabilize" topples all the grains until the pile is stable and "parallel"
+# does the same with WORKERS processes
+SOLVER = "step"
+WORKERS = multiprocessing.cpu_count()
+# Only topple the bounding box of the unstable cells
+ACTIVE_REGION = True
+# Simulate a quadrant of the pile and mirror it
+SYMMETRIC = False
 
 
 ###############################################################################
@@ -79,24 +95,225 @@ class Window:
 ###############################################################################
 # Topple code
 ###############################################################################
+def grow_box(box, shape, margin=1):
+    """Return the (x0, x1, y0, y1) box grown by margin cells"""
+    return (max(box[0] - margin, 0), min(box[1] + margin, shape[0]),
+            max(box[2] - margin, 0), min(box[3] + margin, shape[1]))
+
+
+def toppled_box(toppled, view_box, shape):
+    """Return the box of the cells that may be unstable after toppling the
+    view_box cells, None when no cell toppled"""
+    rows = np.flatnonzero(toppled.any(axis=1))
+    if not len(rows):
+        return None
+    cols = np.flatnonzero(toppled.any(axis=0))
+    return grow_box((view_box[0] + rows[0], view_box[0] + rows[-1] + 1,
+                     view_box[2] + cols[0], view_box[2] + cols[-1] + 1),
+                    shape)
+
+
+def topple(data, grains, mirror_x=False, mirror_y=False):
+    """Topple data // 4 grains of every cell in place, grains is a buffer of
+    the data shape. Return False when the pile is stable."""
+    np.floor_divide(data, 4, out=grains)
+    if not grains.any():
+        return False
+    # The toppled cells keep data % 4 grains
+    np.bitwise_and(data, 3, out=data)
+    data[1:] += grains[:-1]
+    data[:-1] += grains[1:]
+    data[:, 1:] += grains[:, :-1]
+    data[:, :-1] += grains[:, 1:]
+    # A symmetry axis also gets the grains of its mirrored neighbor
+    if mirror_x:
+        data[0] += grains[1]
+    if mirror_y:
+        data[:, 0] += grains[:, 1]
+    return True
+
+
+def stabilize_numpy(data, mirror=False, active=True):
+    grains = np.empty_like(data)
+    box = (0, data.shape[0], 0, data.shape[1])
+    while box:
+        # The view includes the neighbors of the unstable cells
+        view_box = x0, x1, y0, y1 = grow_box(box, data.shape)
+        view = data[x0:x1, y0:y1]
+        view_grains = grains[x0:x1, y0:y1]
+        if not topple(view, view_grains, mirror and x0 == 0,
+                      mirror and y0 == 0):
+            break
+        if active:
+            box = toppled_box(view_grains, view_box, data.shape)
+
+
+def stabilize_numba(data, mirror=False, active=True):
+    width, height = data.shape
+    x0, x1, y0, y1 = 0, width, 0, height
+    unstable = True
+    while unstable:
+        unstable = False
+        box_x0, box_x1, box_y0, box_y1 = width, 0, height, 0
+        for x in range(x0, x1):
+            for y in range(y0, y1):
+                if data[x, y] < 4:
+                    continue
+                grains = data[x, y] // 4
+                data[x, y] &= 3
+                if x > 1 or (x == 1 and not mirror):
+                    data[x - 1, y] += grains
+                elif x == 1:
+                    data[0, y] += 2 * grains
+                if x < width - 1:
+                    data[x + 1, y] += grains
+                if y > 1 or (y == 1 and not mirror):
+                    data[x, y - 1] += grains
+                elif y == 1:
+                    data[x, 0] += 2 * grains
+                if y < height - 1:
+                    data[x, y + 1] += grains
+                box_x0, box_x1 = min(box_x0, x), max(box_x1, x + 1)
+                box_y0, box_y1 = min(box_y0, y), max(box_y1, y + 1)
+                unstable = True
+        if active and unstable:
+            # Only the toppled cells and their neighbors may be unstable
+            x0, x1 = max(box_x0 - 1, 0), min(box_x1 + 1, width)
+            y0, y1 = max(box_y0 - 1, 0), min(box_y1 + 1, height)
+
+
+if njit:
+    stabilize = njit(cache=True)(stabilize_numba)
+else:
+    stabilize = stabilize_numpy
+
+
+def stabilize_band(index, workers, shape, dtype, mirror, barrier, names):
+    """Topple a band of rows of the shared pile until it is stable"""
+    shms = [shared_memory.SharedMemory(name=name) for name in names]
+    data = np.ndarray(shape, dtype, buffer=shms[0].buf)
+    grains = np.ndarray(shape, dtype, buffer=shms[1].buf)
+    boxes = np.ndarray((workers, 4), np.int64, buffer=shms[2].buf)
+    box = (0, shape[0], 0, shape[1])
+    while True:
+        x0, x1, y0, y1 = grow_box(box, shape)
+        # The view rows are split in equal bands, so that the work follows
+        # the active region
+        bands = np.linspace(x0, x1, workers + 1).astype(int)
+        start, end = bands[index], bands[index + 1]
+        band = data[start:end, y0:y1]
+        band_grains = grains[start:end, y0:y1]
+        np.floor_divide(band, 4, out=band_grains)
+        np.bitwise_and(band, 3, out=band)
+        toppled = toppled_box(band_grains, (start, end, y0, y1), shape)
+        boxes[index] = toppled or (shape[0], 0, shape[1], 0)
+        barrier.wait()
+
+        # Every worker reduces the same next box, it is empty when no cell
+        # toppled
+        box = (boxes[:, 0].min(), boxes[:, 1].max(),
+               boxes[:, 2].min(), boxes[:, 3].max())
+        if box[0] >= box[1]:
+            break
+        # The halo rows are the grains of the adjacent bands
+        above = min(max(start, x0 + 1), end)
+        band[above - start:] += grains[above - 1:end - 1, y0:y1]
+        below = max(min(end, x1 - 1), start)
+        band[:below - start] += grains[start + 1:below + 1, y0:y1]
+        band[:, 1:] += band_grains[:, :-1]
+        band[:, :-1] += band_grains[:, 1:]
+        if mirror and start == 0 < end:
+            band[0] += grains[1, y0:y1]
+        if mirror and y0 == 0:
+            band[:, 0] += band_grains[:, 1]
+        barrier.wait()
+    del data, grains, boxes, band, band_grains
+    for shm in shms:
+        shm.close()
+
+
+def stabilize_parallel(data, workers, mirror=False):
+    """Stabilize the pile with workers processes sharing its memory"""
+    shms = [shared_memory.SharedMemory(create=True, size=data.nbytes),
+            shared_memory.SharedMemory(create=True, size=data.nbytes),
+            shared_memory.SharedMemory(create=True, size=workers * 4 * 8)]
+    shared = np.ndarray(data.shape, data.dtype, buffer=shms[0].buf)
+    shared[:] = data
+    barrier = multiprocessing.Barrier(workers)
+    procs = [multiprocessing.Process(target=stabilize_band, args=(
+        index, workers, data.shape, data.dtype, mirror, barrier,
+        [shm.name for shm in shms])) for index in range(workers)]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+    data[:] = shared
+    del shared
+    for shm in shms:
+        shm.close()
+        shm.unlink()
+
+
 class Sandpile(Window):
-    def __init__(self, winsize, amount=100000):
+    def __init__(self, winsize, amount=100000, symmetric=SYMMETRIC,
+                 active=ACTIVE_REGION):
         super().__init__(winsize)
         self.data_size = list(map(lambda x: x // ZOOM, winsize))
         self.data_length = self.data_size[0] * self.data_size[1]
         self.data = np.zeros(self.data_size, dtype=np.int32)
-        self.data[tuple(np.array(self.data_size) // 2)] = amount
+        self.center = tuple(np.array(self.data_size) // 2)
+        self.data[self.center] = amount
         self.kernel = np.array([
             [0,  1, 0],
             [1, -4, 1],
             [0,  1, 0]], dtype=np.int32)
+        self.symmetric = symmetric
+        self.active = active
+        if symmetric:
+            if self.data_size[0] % 2 == 0 or self.data_size[1] % 2 == 0:
+                raise RuntimeError("Symmetric mode needs an odd data size")
+            # Only simulate the bottom-right quadrant, its first row and
+            # column are the symmetry axes
+            self.sim = self.data[self.center[0]:, self.center[1]:]
+        else:
+            self.sim = self.data
+        # The box of the cells that may be unstable
+        self.box = (0, self.sim.shape[0], 0, self.sim.shape[1])
+
+        if SOLVER == "stabilize":
+            # The final pile doesn't depend on the toppling order
+            stabilize(self.sim, symmetric, active)
+            self.box = None
+        elif SOLVER == "parallel":
+            stabilize_parallel(self.sim, WORKERS, symmetric)
+            self.box = None
+        else:
+            for i in range(INIT):
+                self.step()
+        self.reflect()
+
+    def step(self):
+        """Topple one grain quartet of every unstable cell"""
+        if self.box is None:
+            return
+        view_box = x0, x1, y0, y1 = grow_box(self.box, self.sim.shape)
+        view = self.sim[x0:x1, y0:y1]
+        toppling = view > 3
+        view += scipy.signal.correlate2d(toppling, self.kernel, mode='same')
+        if self.symmetric and x0 == 0:
+            view[0] += toppling[1]
+        if self.symmetric and y0 == 0:
+            view[:, 0] += toppling[:, 1]
+        if self.active:
+            self.box = toppled_box(toppling, view_box, self.sim.shape)
 
-        i = INIT
-        while i > 0:
-            toppling = self.data > 3
-            c = scipy.signal.correlate2d(toppling, self.kernel, mode='same')
-            self.data += c
-            i -= 1
+    def reflect(self):
+        """Mirror the simulated quadrant on the whole pile"""
+        if not self.symmetric:
+            return
+        x, y = self.center
+        self.data[:x, y:] = self.data[x + 1:, y:][::-1]
+        self.data[:, :y] = self.data[:, y + 1:][:, ::-1]
 
     def render(self):
         pixels = np.zeros(self.data_length, dtype='i4').reshape(
@@ -110,9 +327,8 @@ class Sandpile(Window):
         pixels[self.data > 3] = hsv(0.6, 0.1, 0.9)
 
         # Tupple sands
-        toppling = self.data > 3
-        c = scipy.signal.correlate2d(toppling, self.kernel, mode='same')
-        self.data += c
+        self.step()
+        self.reflect()
         enlarge = np.repeat(np.repeat(pixels, ZOOM, axis=0), ZOOM, axis=1)
         self.blit(enlarge)
 
@@ -104,7 +104,8 @@ class Window:
 
 class Audio:
     def __init__(self, wav_file, fps=25, play=True):
-        freq, wav = scipy.io.wavfile.read(wav_file)
+        # Memory map the pcm data instead of loading the whole file
+        freq, wav = scipy.io.wavfile.read(wav_file, mmap=True)
         if freq % fps != 0:
             raise RuntimeError("Can't load wav %d Hz at %d fps" % (freq, fps))
         self.audio_frame_size = freq // fps
@@ -137,22 +138,55 @@ def hsv(h, s, v):
     return int(b * 0xff) | int((g * 0xff)) << 8 | int(r * 0xff) << 16
 
 
+# The spectrogram freq values are within [0, 1.875]
+LUT_MAX = 2.
+LUT_SIZE = 2048
+
+
+def hsv_lut(color, size=LUT_SIZE, max_value=LUT_MAX):
+    """Precompute the hsv(*color(point)) of points within [0, max_value]"""
+    return np.array([hsv(*color(point))
+                     for point in np.linspace(0, max_value, size)], dtype='i4')
+
+
+def lut_index(points, size=LUT_SIZE, max_value=LUT_MAX):
+    return np.clip(np.rint(points * ((size - 1) / max_value)),
+                   0, size - 1).astype(int)
+
+
+def blit_ring(surface, columns, head):
+    """Blit a ring of columns, the oldest one being after the head"""
+    split = len(columns) - head - 1
+    height = surface.get_height()
+    if split:
+        pygame.surfarray.blit_array(
+            surface.subsurface((0, 0, split, height)), columns[head + 1:])
+    pygame.surfarray.blit_array(
+        surface.subsurface((split, 0, head + 1, height)), columns[:head + 1])
+
+
+def bars(values, height, color=0xfafafa):
+    """Return the pixels of vertical bars of values ratio of height"""
+    top = (height - values * height).astype(int)
+    return np.where(np.arange(height) >= top[:, np.newaxis], color, 0)
+
+
 class Waterfall(Window):
     def __init__(self, window_size, zoom=1):
         Window.__init__(self, window_size)
         self.zoom = zoom
-        self.pixels = np.zeros(self.length, dtype='i4').reshape(*self.size)
+        self.columns = np.zeros(self.size, dtype='i4')
+        self.head = self.size[0] - 1
+        self.lut = hsv_lut(lambda point: (
+            0.5 + 0.4 * point, 0.3 + 0.6 * point, 0.2 + 0.7 * point))
+        # The freq index of each row, from the bottom
+        self.rows = np.arange(self.size[1] - 1, -1, -1) // zoom
 
     def render(self, spectrogram):
-        self.pixels = np.roll(self.pixels, -1, axis=0)
-        for y in range(0, self.size[1], self.zoom):
-            inv_y = self.size[1] - y - 1
-            point = spectrogram.freq[y // self.zoom]
-            for suby in range(self.zoom):
-                self.pixels[-1][inv_y - suby] = hsv(
-                    0.5 + 0.4 * point,
-                    0.3 + 0.6 * point,
-                    0.2 + 0.7 * point)
+        self.head = (self.head + 1) % self.size[0]
+        self.columns[self.head] = self.lut[lut_index(
+            spectrogram.freq[self.rows])]
+        blit_ring(self.surface, self.columns, self.head)
 
 
 class SpectroGraph(Window):
@@ -162,22 +196,17 @@ class SpectroGraph(Window):
         self.decay = 10
         self.values = np.zeros(frame_size // 2)
         self.graph_length = min(self.size[0] - self.zoom, frame_size // 2)
+        self.bands = -(-self.graph_length // self.zoom)
+        self.graph = np.zeros(self.size, dtype='i4')
 
     def render(self, spectrogram):
-        self.fill(0x00000)
-        for x in range(0, self.graph_length, self.zoom):
-            freq_pos = x // self.zoom
-            val = spectrogram.band[freq_pos]
-            if self.values[freq_pos] > val:
-                decay = (self.values[freq_pos] - val) / self.decay
-                val = self.values[freq_pos] - decay
-            self.values[freq_pos] = val
-            for subx in range(self.zoom):
-                self.draw_line(
-                    (x + subx, self.size[1]),
-                    (x + subx, self.size[1] - val * self.size[1]),
-                    0xfafafa
-                    )
+        values = self.values[:self.bands]
+        val = spectrogram.band[:self.bands]
+        decayed = values - (values - val) / self.decay
+        values[:] = np.where(values > val, decayed, val)
+        self.graph[:self.bands * self.zoom] = bars(
+            np.repeat(values, self.zoom), self.size[1])
+        self.blit(self.graph)
 
 
 ###############################################################################